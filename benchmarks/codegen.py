@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Wall-clock time of the code generation phase (rust-sgx-gen) of N Native
+# modules, and the longest time the event loop was blocked meanwhile.
+#
+# Each module is a copy of examples/example_native/sm1. Requires rust-sgx-gen.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+EXAMPLE = os.path.join(ROOT, "examples", "example_native", "sm1")
+
+
+def make_workspace(workspace, n):
+    modules = []
+
+    for i in range(n):
+        name = "sm{}".format(i)
+        shutil.copytree(EXAMPLE, os.path.join(workspace, name))
+        modules.append({"type": "native", "name": name, "node": "node"})
+
+    with open(os.path.join(workspace, "input.json"), 'w') as f:
+        json.dump({
+            "nodes": [{"type": "native", "name": "node",
+                       "ip_address": "127.0.0.1", "reactive_port": 5000}],
+            "modules": modules
+        }, f)
+
+
+async def ticker(stalls, done):
+    last = time.monotonic()
+
+    while not done.is_set():
+        await asyncio.sleep(0.01)
+        now = time.monotonic()
+        stalls.append(now - last - 0.01)
+        last = now
+
+
+async def generate(conf):
+    stalls = []
+    done = asyncio.Event()
+    ticker_fut = asyncio.ensure_future(ticker(stalls, done))
+
+    await asyncio.gather(*[m.generate_code() for m in conf.modules])
+
+    done.set()
+    await ticker_fut
+    return max(stalls, default=0)
+
+
+def run(n):
+    from reactivetools import config, glob, tools
+
+    # nothing from the previous runs (e.g., the build cache) is reused
+    shutil.rmtree(glob.BUILD_DIR, ignore_errors=True)
+    os.mkdir(glob.BUILD_DIR)
+
+    conf = config.load("input.json")
+
+    start = time.monotonic()
+    stall = asyncio.get_event_loop().run_until_complete(generate(conf))
+    elapsed = time.monotonic() - start
+
+    tools.shutdown_process_pool()
+    return elapsed, stall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*', type=int, default=[1, 8, 64],
+                        help='numbers of modules')
+    parser.add_argument('--workers', type=int, nargs='*', default=None,
+                        help='numbers of code generation workers (default: 1 and the number of CPUs)')
+    args = parser.parse_args()
+
+    workers = args.workers or sorted({1, os.cpu_count() or 1})
+
+    with tempfile.TemporaryDirectory() as workspace:
+        # the build directory is taken from the working directory on import
+        os.chdir(workspace)
+        sys.path.insert(0, ROOT)
+
+        from reactivetools import glob
+
+        for n in args.modules:
+            for dir in os.listdir(workspace):
+                shutil.rmtree(os.path.join(workspace, dir), ignore_errors=True)
+            make_workspace(workspace, n)
+
+            for w in workers:
+                glob.set_codegen_workers(w)
+                elapsed, stall = run(n)
+                print("{:3} modules, {:2} workers: {:.2f}s, event loop blocked "
+                      "for at most {:.0f} ms".format(n, w, elapsed, stall * 1000),
+                      flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import yaml
+
+from reactivetools import glob
+from reactivetools.descriptor import DescriptorType
+
+# Load and dump times of JSON and YAML deployment descriptors of a given size.
+#
+# "before" is how descriptors were handled before format detection and the
+# libyaml bindings: JSON is tried first and YAML is parsed again with the
+# pure-Python loader, and JSON is always pretty-printed.
+
+# approximate size of a connection in a JSON descriptor, in bytes
+CONNECTION_SIZE = 270
+
+
+def make_descriptor(size):
+    modules = 1000
+    connections = int(size / CONNECTION_SIZE)
+
+    return {
+        "nodes": [{"type": "native", "name": "node", "ip_address": "127.0.0.1",
+                   "reactive_port": 5000}],
+        "modules": [{"type": "native", "name": "sm{}".format(i), "node": "node",
+                     "data": {"inputs": {"in{}".format(j): j for j in range(4)}}}
+                    for i in range(modules)],
+        "connections": [{"name": "conn{}".format(i),
+                         "from_module": "sm{}".format(i % modules),
+                         "from_output": "output",
+                         "to_module": "sm{}".format((i + 1) % modules),
+                         "to_input": "input",
+                         "encryption": "aes",
+                         "key": "00112233445566778899aabbccddeeff",
+                         "id": i, "nonce": 3, "established": True,
+                         "direct": False} for i in range(connections)]
+    }
+
+
+def load_before(file):
+    try:
+        with open(file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        with open(file, 'r') as f:
+            return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def dump_before(file, data, type):
+    with open(file, 'w') as f:
+        if type == DescriptorType.JSON:
+            json.dump(data, f, indent=4)
+        else:
+            yaml.dump(data, f, Dumper=yaml.Dumper)
+
+
+def measure(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def format_time(t):
+    return "      -" if t is None else "{:6.2f}s".format(t)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=[1, 10, 100],
+                        help='sizes of the descriptors, in MB')
+    parser.add_argument('--skip-before', action='store_true',
+                        help='do not measure the previous implementation (slow for large YAML files)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            data = make_descriptor(size * 1000 * 1000)
+
+            for type, ext in [(DescriptorType.JSON, "json"),
+                              (DescriptorType.YAML, "yaml")]:
+                file = os.path.join(tmp, "descriptor.{}".format(ext))
+
+                if args.skip_before:
+                    dump_old = load_old = None
+                else:
+                    dump_old = measure(lambda: dump_before(file, data, type))
+                    load_old = measure(lambda: load_before(file))
+
+                glob.set_compact_output(True)
+                dump_new = measure(lambda: type.dump(file, data))
+                load_new = measure(lambda: DescriptorType.load_any(file))
+
+                print("{:4} MB {:4} ({:6.1f} MB): load {} -> {}, dump {} -> {}".format(
+                        size, ext, os.path.getsize(file) / 1e6,
+                        *map(format_time, [load_old, load_new, dump_old, dump_new])),
+                      flush=True)
+
+
+if __name__ == "__main__":
+    main()
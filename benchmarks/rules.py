@@ -0,0 +1,78 @@
+import argparse
+import os
+import time
+
+from reactivetools import config
+from reactivetools.descriptor import DescriptorType
+from reactivetools.rules import evaluators
+
+# Cost of validating a deployment descriptor (config.check_rules), per object.
+#
+# "uncached" evaluates the rules as before they were compiled and cached:
+# the rule file is parsed again and each rule is evaluated from its string
+# for every object.
+
+
+def make_descriptor(modules, connections):
+    return {
+        "nodes": [{"type": "native", "name": "node", "ip_address": "127.0.0.1",
+                   "reactive_port": 5000}],
+        "modules": [{"type": "native", "name": "sm{}".format(i), "node": "node"}
+                    for i in range(modules)],
+        "connections": [{"from_module": "sm{}".format(i % modules),
+                         "from_output": "output",
+                         "to_module": "sm{}".format((i + 1) % modules),
+                         "to_input": "input",
+                         "encryption": "aes"} for i in range(connections)]
+    }
+
+
+def uncached_eval(rules_file, obj):
+    path = os.path.join(os.path.dirname(evaluators.__file__), rules_file)
+    rules = DescriptorType.YAML.load(path) or {}
+    env = vars(evaluators).copy()
+
+    for rule in rules:
+        try:
+            eval(str(rules[rule]), env, {"dict": obj})
+        except Exception:
+            pass
+
+
+def uncached_check(contents):
+    for n in contents["nodes"]:
+        uncached_eval("default/node.yaml", n)
+        uncached_eval("nodes/native.yaml", n)
+
+    for m in contents["modules"]:
+        uncached_eval("default/module.yaml", m)
+        uncached_eval("modules/native.yaml", m)
+
+    for c in contents["connections"]:
+        uncached_eval("default/connection.yaml", c)
+
+
+def measure(fn, contents):
+    start = time.perf_counter()
+    fn(contents)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=100)
+    parser.add_argument('--connections', type=int, default=10000)
+    args = parser.parse_args()
+
+    contents = make_descriptor(args.modules, args.connections)
+    objs = 1 + args.modules + args.connections
+
+    for name, fn in [("uncached", uncached_check),
+                     ("check_rules", config.check_rules)]:
+        elapsed = measure(fn, contents)
+        print("{:12} {} objects: {:.3f}s ({:.1f} us/object)".format(
+                name, objs, elapsed, elapsed / objs * 1e6))
+
+
+if __name__ == "__main__":
+    main()
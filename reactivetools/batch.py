@@ -0,0 +1,141 @@
+import asyncio
+import binascii
+import json
+import logging
+
+# Batch mode (`reactive-tools batch`)
+#
+# Runs a stream of call, output and request operations in a single process,
+# a few of them at the same time. Each line of the input is a JSON object:
+#   {"module": "sm1", "entry": "entry", "arg": "0a0b"}   -> call
+#   {"connection": "conn1", "arg": "0a0b"}               -> output or request
+#
+# A connection is either the name or the ID of a direct connection: the
+# operation is an output or a request depending on the connection, or on the
+# optional "command" key ("call", "output" or "request"). Byte arrays are hex
+# strings, "arg" is optional.
+#
+# The result of each operation is written as a JSON line as soon as it
+# completes, with the line number of the operation and its "id", if any:
+#   {"line": 1, "ok": true, "response": "0c0d"}
+#   {"line": 2, "ok": false, "error": "No module with name sm3"}
+#
+# Nonces are updated in memory (see Config.output_async): the changed
+# connections are written to the descriptor once, at the end.
+
+class Error(Exception):
+    pass
+
+
+class Batch():
+    def __init__(self, conf, concurrency):
+        if concurrency < 1:
+            raise Error("Bad concurrency: {}".format(concurrency))
+
+        self.conf = conf
+        self.concurrency = concurrency
+        self.total = 0
+        self.failed = 0
+
+        # ID -> connection whose nonce changed
+        self.__changed = {}
+
+
+    # Connections to write back to the descriptor
+    @property
+    def changed(self):
+        return list(self.__changed.values())
+
+
+    # Coroutine. Runs the operations read from `input` (a file object),
+    # writing the results to `output`
+    async def run(self, input, output):
+        loop = asyncio.get_event_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+        pending = set()
+        line_no = 0
+
+        while True:
+            # reading a pipe might block, e.g., if operations come from stdin
+            line = await loop.run_in_executor(None, input.readline)
+            if not line:
+                break
+
+            line_no += 1
+            if not line.strip():
+                continue
+
+            await sem.acquire()
+
+            task = asyncio.ensure_future(self.__run_one(line_no, line, output))
+            task.add_done_callback(lambda t: sem.release())
+            task.add_done_callback(pending.discard)
+            pending.add(task)
+
+        if pending:
+            await asyncio.gather(*pending)
+
+
+    async def __run_one(self, line_no, line, output):
+        self.total += 1
+        result = {"line": line_no}
+
+        try:
+            op = json.loads(line)
+            if not isinstance(op, dict):
+                raise Error("Bad operation: {}".format(line.strip()))
+
+            if op.get("id") is not None:
+                result["id"] = op["id"]
+
+            response = await self.__execute(op)
+
+            result["ok"] = True
+            if response is not None:
+                result["response"] = binascii.hexlify(response).decode('ascii')
+        except Exception as e:
+            logging.error("Line {}: {}".format(line_no, e))
+            self.failed += 1
+            result["ok"] = False
+            result["error"] = str(e) or type(e).__name__
+
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+
+    async def __execute(self, op):
+        command = op.get("command") or self.__get_command(op)
+        arg = op.get("arg")
+        arg = None if arg is None else binascii.unhexlify(arg)
+
+        if command == "call":
+            return await self.conf.call_async(_get(op, "module"),
+                                              _get(op, "entry"), arg)
+
+        if command == "output":
+            conn = await self.conf.output_async(_get(op, "connection"), arg)
+            self.__changed[conn.id] = conn
+            return None
+
+        if command == "request":
+            conn, response = await self.conf.request_async(
+                                        _get(op, "connection"), arg)
+            self.__changed[conn.id] = conn
+            return response
+
+        raise Error("Unknown command: {}".format(command))
+
+
+    def __get_command(self, op):
+        if op.get("module") is not None:
+            return "call"
+
+        conn = self.conf.get_connection(_get(op, "connection"))
+        return "request" if conn.to_handler else "output"
+
+
+def _get(op, key):
+    if op.get(key) is None:
+        raise Error("Missing {}".format(key))
+
+    return op[key]
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+import json
+import logging
+
+from . import glob
+from . import tools
+
+# Content-addressed cache of build artifacts.
+# An artifact is stored under build/cache/ with the digest of all the inputs
+# used to produce it as file name, so that it can be reused by any module and
+# across different runs if none of these inputs changed.
+
+CACHE_DIR = os.path.join(glob.BUILD_DIR, "cache")
+
+
+def digest(*parts):
+    h = hashlib.sha256()
+
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode()
+
+        # length prefix, to avoid ambiguities between adjacent parts
+        h.update(tools.pack_int32(len(part)))
+        h.update(part)
+
+    return h.hexdigest()
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def get_path(key, suffix=''):
+    return os.path.join(CACHE_DIR, key[:2], key + suffix)
+
+
+def lookup(key, suffix=''):
+    path = get_path(key, suffix)
+    return path if os.path.exists(path) else None
+
+
+# Copy `file` in the cache, returning the path of the cached artifact
+def store(key, file, suffix=''):
+    path = get_path(key, suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # copy and rename, so that a partial artifact is never found by lookup()
+    tmp = tools.create_tmp(suffix=suffix, dir=os.path.dirname(path))
+    shutil.copyfile(file, tmp)
+    os.replace(tmp, path)
+
+    logging.debug("Stored {} in cache as {}".format(file, path))
+    return path
+
+
+def hash_dir(path, exclude=["target"]):
+    h = hashlib.sha256()
+
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in exclude and not d.startswith('.'))
+
+        for f in sorted(files):
+            file = os.path.join(root, f)
+            h.update(digest(os.path.relpath(file, path), hash_file(file)).encode())
+
+    return h.hexdigest()
+
+
+# Manifests record the inputs (fingerprint) and outputs of the last build of a
+# module, for builds whose outputs are not single files (e.g., cargo builds)
+
+def _get_manifest_path(name):
+    return os.path.join(CACHE_DIR, "manifests", name + ".json")
+
+
+def load_manifest(name, fingerprint):
+    path = _get_manifest_path(name)
+
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("fingerprint") != fingerprint:
+        return None
+
+    # the outputs might have been removed or overwritten in the meantime
+    for path, hash in manifest.get("files", {}).items():
+        if not os.path.exists(path) or hash_file(path) != hash:
+            return None
+
+    return manifest
+
+
+# `files` are the output files, checked when the manifest is loaded again
+def save_manifest(name, fingerprint, manifest, files=[]):
+    path = _get_manifest_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    manifest = dict(manifest, fingerprint=fingerprint,
+                    files={f: hash_file(f) for f in files})
+
+    tmp = tools.create_tmp(suffix='.json', dir=os.path.dirname(path))
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+# Version of an installed package (e.g., a code generator), or None
+def get_version(package):
+    try:
+        from importlib.metadata import version
+        return version(package)
+    except Exception:
+        return None
@@ -1,15 +1,16 @@
 import argparse
 import logging
-import asyncio
 import sys
 import binascii
 import os
 import contextlib
 
-from . import config
-from . import tools
+from . import client
 from . import glob
 
+# The rest of the package (and asyncio) is imported by the handlers, so that
+# commands sent to a daemon with --socket only import the client
+
 
 class Error(Exception):
     pass
@@ -26,6 +27,20 @@ def _setup_logging(args):
     logging.basicConfig(format='%(levelname)s: %(message)s', level=level)
 
 
+# Size in bytes, with an optional K, M or G suffix (e.g., 64M)
+def _parse_size(size):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = size.strip().upper().rstrip('B')
+
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {}".format(size))
+
+
 def _parse_args(args):
     parser = argparse.ArgumentParser()
 
@@ -37,6 +52,38 @@ def _parse_args(args):
         '--debug',
         help='Debug output',
         action='store_true')
+    parser.add_argument(
+        '--compact',
+        help='Write compact JSON deployment descriptors (no pretty-printing)',
+        action='store_true')
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Maximum number of build jobs running at the same time (default: number of CPUs)',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--codegen-workers',
+        help='Number of processes running code generation of modules in parallel (default: number of CPUs)',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--timeout',
+        help='Seconds to wait for a node to answer a command (default: no timeout)',
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--retries',
+        help='Number of times idempotent commands are sent again to nodes that do not answer (default: 3)',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--continue-on-error',
+        help='Go on with the other modules, connections and events when some of them fail, recording the failures in the resulting configuration',
+        action='store_true')
+    parser.add_argument(
+        '--socket',
+        help='Control socket of a daemon (see serve): the command is run by the daemon instead of this process',
+        default=None)
 
     subparsers = parser.add_subparsers(dest='command')
     # Workaround a Python bug. See http://bugs.python.org/issue9253#msg186387
@@ -52,6 +99,10 @@ def _parse_args(args):
         help='build mode of modules. between "debug" and "release"',
         default='debug'
     )
+    deploy_parser.add_argument(
+        '--shared-target',
+        help='Build Rust modules in a cargo target directory shared by all modules, reusing common dependencies',
+        action='store_true')
     deploy_parser.add_argument(
         'config',
         help='Name of the configuration file describing the network')
@@ -68,12 +119,22 @@ def _parse_args(args):
         action='store_true')
     deploy_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
         default=None)
     deploy_parser.add_argument(
         '--module',
         help='Module to deploy (if not specified, deploy all modules not yet deployed)',
         default=None)
+    deploy_parser.add_argument(
+        '--deploy-budget',
+        help='Maximum size of the modules being sent to all nodes at the same time (e.g., 512M)',
+        type=_parse_size,
+        default=None)
+    deploy_parser.add_argument(
+        '--node-deploy-budget',
+        help='Maximum size of the modules being sent to each node at the same time (e.g., 64M)',
+        type=_parse_size,
+        default=None)
 
     # build
     build_parser = subparsers.add_parser(
@@ -85,6 +146,10 @@ def _parse_args(args):
         help='build mode of modules. between "debug" and "release"',
         default='debug'
     )
+    build_parser.add_argument(
+        '--shared-target',
+        help='Build Rust modules in a cargo target directory shared by all modules, reusing common dependencies',
+        action='store_true')
     build_parser.add_argument(
         'config',
         help='Name of the configuration file describing the network')
@@ -110,7 +175,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     attest_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
         default=None)
     attest_parser.add_argument(
         '--module',
@@ -130,7 +195,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     connect_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
         default=None)
     connect_parser.add_argument(
         '--connection',
@@ -150,7 +215,7 @@ def _parse_args(args):
         help='File to write the resulting configuration to')
     register_parser.add_argument(
         '--output',
-        help='Output file type, between JSON and YAML',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
         default=None)
     register_parser.add_argument(
         '--event',
@@ -221,13 +286,107 @@ def _parse_args(args):
         '--result',
         help='File to write the resulting configuration to')
 
+    # batch
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Run call, output and request operations read as JSON lines from a file or stdin')
+    batch_parser.set_defaults(command_handler=_handle_batch)
+    batch_parser.add_argument(
+        'config',
+        help='Specify configuration file to use')
+    batch_parser.add_argument(
+        '--input',
+        help='File containing the operations, one JSON object per line (default: stdin)',
+        default='-')
+    batch_parser.add_argument(
+        '--concurrency',
+        help='Maximum number of operations running at the same time',
+        type=int,
+        default=16)
+    batch_parser.add_argument(
+        '--result',
+        help='File to write the resulting configuration to')
+
+    # convert
+    convert_parser = subparsers.add_parser(
+        'convert',
+        help='Convert a deployment descriptor to another format (e.g., import/export a SQLite descriptor)')
+    convert_parser.set_defaults(command_handler=_handle_convert)
+    convert_parser.add_argument(
+        'config',
+        help='Specify configuration file to use')
+    convert_parser.add_argument(
+        '--result',
+        help='File to write the converted configuration to',
+        required=True)
+    convert_parser.add_argument(
+        '--output',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
+        required=True)
+
+    # serve
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Run a daemon keeping the deployment loaded, accepting commands on the --socket control socket')
+    serve_parser.set_defaults(command_handler=_handle_serve)
+    serve_parser.add_argument(
+        '--mode',
+        help='build mode of modules. between "debug" and "release"',
+        default='debug'
+    )
+    serve_parser.add_argument(
+        '--shared-target',
+        help='Build Rust modules in a cargo target directory shared by all modules, reusing common dependencies',
+        action='store_true')
+    serve_parser.add_argument(
+        'config',
+        help='Name of the configuration file describing the network')
+    serve_parser.add_argument(
+        '--workspace',
+        help='Root directory containing all the modules and the configuration file',
+        default=".")
+    serve_parser.add_argument(
+        '--result',
+        help='File to write the resulting configuration to')
+    serve_parser.add_argument(
+        '--output',
+        help='Output file type, between JSON, YAML, BINARY and SQLITE',
+        default=None)
+    serve_parser.add_argument(
+        '--deploy-budget',
+        help='Maximum size of the modules being sent to all nodes at the same time (e.g., 512M)',
+        type=_parse_size,
+        default=None)
+    serve_parser.add_argument(
+        '--node-deploy-budget',
+        help='Maximum size of the modules being sent to each node at the same time (e.g., 64M)',
+        type=_parse_size,
+        default=None)
+
     return parser.parse_args(args)
 
 
+# With --continue-on-error, the failures are recorded in the deployment
+# descriptor: they are reported at the end of the command
+def _check_failures(failures):
+    if not failures:
+        return
+
+    for failure in failures:
+        logging.error("{} of {} failed: {}".format(
+            failure["operation"], failure["name"], failure["error"]))
+
+    raise Error("{} operation(s) failed".format(len(failures)))
+
+
 def _handle_deploy(args):
+    from . import config
+
     logging.info('Deploying %s', args.config)
 
     glob.set_build_mode(args.mode)
+    glob.set_shared_target(args.shared_target)
+    glob.set_deploy_budget(args.deploy_budget, args.node_deploy_budget)
 
     os.chdir(args.workspace)
     conf = config.load(args.config, args.output)
@@ -238,12 +397,16 @@ def _handle_deploy(args):
     logging.info('Writing post-deployment configuration to %s', out_file)
     config.dump_config(conf, out_file)
     conf.cleanup()
+    _check_failures(conf.failures)
 
 
 def _handle_build(args):
+    from . import config
+
     logging.info('Building %s', args.config)
 
     glob.set_build_mode(args.mode)
+    glob.set_shared_target(args.shared_target)
 
     os.chdir(args.workspace)
     conf = config.load(args.config)
@@ -253,6 +416,8 @@ def _handle_build(args):
 
 
 def _handle_attest(args):
+    from . import config
+
     logging.info('Attesting modules')
 
     conf = config.load(args.config, args.output)
@@ -261,11 +426,17 @@ def _handle_attest(args):
 
     out_file = args.result or args.config
     logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    if args.module:
+        config.update_config(conf, [conf.get_module(args.module)], out_file)
+    else:
+        config.dump_config(conf, out_file)
     conf.cleanup()
+    _check_failures(conf.failures)
 
 
 def _handle_connect(args):
+    from . import config
+
     logging.info('Connecting modules')
 
     conf = config.load(args.config, args.output)
@@ -274,11 +445,20 @@ def _handle_connect(args):
 
     out_file = args.result or args.config
     logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    if args.connection:
+        # set_key also updates the nonces of the modules involved
+        conn = conf.get_connection_by_name(args.connection)
+        modules = [m for m in [conn.from_module, conn.to_module] if m is not None]
+        config.update_config(conf, [conn] + modules, out_file)
+    else:
+        config.dump_config(conf, out_file)
     conf.cleanup()
+    _check_failures(conf.failures)
 
 
 def _handle_register(args):
+    from . import config
+
     logging.info('Registering periodic events')
 
     conf = config.load(args.config, args.output)
@@ -287,77 +467,170 @@ def _handle_register(args):
 
     out_file = args.result or args.config
     logging.info('Writing post-deployment configuration to %s', out_file)
-    config.dump_config(conf, out_file)
+    if args.event:
+        config.update_config(conf, [conf.get_periodic_event(args.event)], out_file)
+    else:
+        config.dump_config(conf, out_file)
     conf.cleanup()
+    _check_failures(conf.failures)
 
 
 def _handle_call(args):
+    import asyncio
+    from . import config
+
     logging.info('Calling %s:%s', args.module, args.entry)
 
-    conf = config.load(args.config)
-    module = conf.get_module(args.module)
+    conf = config.load(args.config, lazy=True)
 
     asyncio.get_event_loop().run_until_complete(
-                                            module.call(args.entry, args.arg))
+                                conf.call_async(args.module, args.entry, args.arg))
 
     conf.cleanup()
 
 
 def _handle_output(args):
+    import asyncio
+    from . import config
+
     logging.info('Triggering output of connection %s', args.connection)
 
-    conf = config.load(args.config)
+    conf = config.load(args.config, lazy=True)
+    out_file = args.result or args.config
+    config.reserve_nonces(conf, out_file)
 
-    if args.connection.isnumeric():
-        conn = conf.get_connection_by_id(int(args.connection))
-    else:
-        conn = conf.get_connection_by_name(args.connection)
+    conn = asyncio.get_event_loop().run_until_complete(
+                                conf.output_async(args.connection, args.arg))
 
+    config.update_config(conf, [conn], out_file)
+    conf.cleanup()
 
-    if not conn.direct:
-        raise Error("Connection is not direct.")
 
-    if not conn.to_input:
-        raise Error("Not a output-input connection")
+def _handle_request(args):
+    import asyncio
+    from . import config
 
-    asyncio.get_event_loop().run_until_complete(
-                                    conn.to_module.node.output(conn, args.arg))
+    logging.info('Triggering request of connection %s', args.connection)
 
-    conn.nonce += 1
+    conf = config.load(args.config, lazy=True)
     out_file = args.result or args.config
-    config.dump_config(conf, out_file)
+    config.reserve_nonces(conf, out_file)
+
+    conn, _ = asyncio.get_event_loop().run_until_complete(
+                                conf.request_async(args.connection, args.arg))
+
+    config.update_config(conf, [conn], out_file)
     conf.cleanup()
 
 
-def _handle_request(args):
-    logging.info('Triggering request of connection %s', args.connection)
+def _handle_batch(args):
+    import asyncio
+    from . import config
+    from . import batch
 
-    conf = config.load(args.config)
+    logging.info('Running operations from %s', args.input)
 
-    if args.connection.isnumeric():
-        conn = conf.get_connection_by_id(int(args.connection))
-    else:
-        conn = conf.get_connection_by_name(args.connection)
+    conf = config.load(args.config, lazy=True)
+    out_file = args.result or args.config
+    config.reserve_nonces(conf, out_file, in_advance=True)
+    runner = batch.Batch(conf, args.concurrency)
 
+    input = sys.stdin if args.input == '-' else open(args.input, 'r')
 
-    if not conn.direct:
-        raise Error("Connection is not direct.")
+    try:
+        asyncio.get_event_loop().run_until_complete(
+                                            runner.run(input, sys.stdout))
+    finally:
+        if input is not sys.stdin:
+            input.close()
 
-    if not conn.to_handler:
-        raise Error("Not a request-handler connection")
+        # nonces of the operations that succeeded, even after an error
+        if runner.changed:
+            config.update_config(conf, runner.changed, out_file)
+        conf.cleanup()
 
-    asyncio.get_event_loop().run_until_complete(
-                                    conn.to_module.node.request(conn, args.arg))
+    if runner.failed:
+        raise Error("{} of {} operation(s) failed".format(
+                        runner.failed, runner.total))
 
-    conn.nonce += 2
-    out_file = args.result or args.config
-    config.dump_config(conf, out_file)
-    conf.cleanup()
+
+def _handle_serve(args):
+    import asyncio
+    from . import config
+    from . import daemon
+
+    if args.socket is None:
+        raise Error("serve requires --socket")
+
+    logging.info('Serving %s', args.config)
+
+    glob.set_build_mode(args.mode)
+    glob.set_shared_target(args.shared_target)
+    glob.set_deploy_budget(args.deploy_budget, args.node_deploy_budget)
+
+    # relative to the directory where the daemon is started
+    path = os.path.abspath(args.socket)
+
+    os.chdir(args.workspace)
+    conf = config.load(args.config, args.output)
+
+    server = daemon.Server(conf, args.result or args.config)
+
+    try:
+        asyncio.get_event_loop().run_until_complete(server.serve(path))
+    finally:
+        conf.cleanup()
+
+
+# With --socket, the command is sent to the daemon, which has its own build
+# settings (e.g., --mode) and descriptor format
+def _send_to_daemon(args):
+    if args.command not in client.COMMANDS:
+        raise Error("{} cannot be run by a daemon".format(args.command))
+
+    if getattr(args, 'output', None) is not None:
+        raise Error("The descriptor format is set when the daemon is started")
+
+    # deploy works in its workspace, the other commands in the current dir
+    base = getattr(args, 'workspace', '.')
+    request = {
+        "command": args.command,
+        "config": os.path.abspath(os.path.join(base, args.config))
+    }
+
+    if getattr(args, 'result', None) is not None:
+        request["result"] = os.path.abspath(os.path.join(base, args.result))
+
+    if getattr(args, 'deploy_in_order', False):
+        request["in_order"] = True
+
+    for key in ["module", "entry", "connection", "event"]:
+        if getattr(args, key, None) is not None:
+            request[key] = getattr(args, key)
+
+    if getattr(args, 'arg', None) is not None:
+        request["arg"] = binascii.hexlify(args.arg).decode('ascii')
+
+    response = client.send_request(args.socket, request)
+
+    if response.get("response") is not None:
+        logging.info("Response: \"{}\"".format(response["response"]))
+
+    _check_failures(response.get("failures"))
+
+
+def _handle_convert(args):
+    from . import config
+
+    logging.info('Converting %s to %s', args.config, args.result)
+
+    config.convert(args.config, args.result, args.output)
 
 
 def main(raw_args=None):
     args = _parse_args(raw_args)
     _setup_logging(args)
+    glob.set_compact_output(args.compact)
 
     # create working directory
     try:
@@ -369,14 +642,35 @@ def main(raw_args=None):
         sys.exit(-1)
 
     try:
-        args.command_handler(args)
+        if args.jobs is not None:
+            glob.set_jobs(args.jobs)
+        if args.codegen_workers is not None:
+            glob.set_codegen_workers(args.codegen_workers)
+        if args.timeout is not None:
+            glob.set_command_timeout(args.timeout or None)
+        if args.retries is not None:
+            glob.set_command_retries(args.retries)
+        glob.set_continue_on_error(args.continue_on_error)
+
+        if args.socket is not None and args.command != 'serve':
+            _send_to_daemon(args)
+        else:
+            args.command_handler(args)
     except Exception as e:
         if args.debug:
             raise
 
         logging.error(e)
 
-        for task in asyncio.Task.all_tasks():
+        import asyncio
+
+        # Task.all_tasks was removed in Python 3.9
+        if hasattr(asyncio.Task, "all_tasks"):
+            tasks = asyncio.Task.all_tasks()
+        else:
+            tasks = asyncio.all_tasks(asyncio.get_event_loop())
+
+        for task in tasks:
             task.cancel()
 
         sys.exit(-1)
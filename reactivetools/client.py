@@ -0,0 +1,47 @@
+import json
+import socket
+
+# Client of the deployment daemon (see daemon.py), used by the CLI with
+# --socket. It only depends on the standard library, so that sending a command
+# to the daemon does not import (nor load) anything else
+
+# commands that can be sent to the daemon
+COMMANDS = ["deploy", "attest", "connect", "register", "call", "output",
+            "request", "shutdown"]
+
+
+class Error(Exception):
+    pass
+
+
+# Sends `request` to the daemon listening on `path`, and returns
+# its response. Raises Error if the command failed
+def send_request(path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except OSError as e:
+            raise Error("Cannot connect to the daemon on {}: {}".format(path, e))
+
+        s.sendall(json.dumps(request).encode() + b'\n')
+
+        with s.makefile('rb') as f:
+            line = f.readline()
+
+    if not line:
+        raise Error("The daemon closed the connection")
+
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise Error(response.get("error"))
+
+    return response
+
+
+def is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+            return True
+        except OSError:
+            return False
@@ -10,13 +10,21 @@ from .connection import Connection
 from .crypto import Encryption
 from .periodic_event import PeriodicEvent
 from . import tools
+from . import glob
+from . import journal
+from . import store
 from .dumpers import *
 from .loaders import *
 from .rules.evaluators import *
 from .descriptor import DescriptorType
 
-from .nodes import node_rules, node_funcs, node_cleanup_coros
-from .modules import module_rules, module_funcs, module_cleanup_coros
+from .nodes import node_registry
+from .nodes import pool
+from .modules import module_registry
+
+# maximum number of nonces of a connection reserved at once in advance
+# (see reserve_nonces)
+MAX_NONCE_RESERVATION = 256
 
 
 class Error(Exception):
@@ -28,46 +36,249 @@ class Config:
         self.nodes = []
         self.modules = []
         self.connections = []
-        self.connections_id = 0
+        self.periodic_events = []
+        self.connections_current_id = 0
+        self.events_current_id = 0
         self.output_type = None
+        self.input_file = None
+        self.input_type = None
+        self.journal_entries = None
+        self.journal_generation = 0
+
+        # operations that failed in continue-on-error mode (see add_failure)
+        self.failures = []
+
+        # (section, name) of the objects in self.failures
+        self.__failed_objects = set()
+
+        # direct connection -> lock, held while using its nonce
+        self.__nonce_locks = {}
+
+        # SQLite descriptor where nonces are reserved (see reserve_nonces)
+        self.nonce_store = None
+
+        # connection name -> [next, end, size] of the nonces reserved in
+        # advance, if they are (see reserve_nonces)
+        self.nonce_ranges = None
+
+        # raw contents of the descriptor, if objects are loaded on demand
+        self.lazy_contents = None
+
+        # indexes, kept up to date by the add_* methods below
+        self.__nodes_by_name = {}
+        self.__modules_by_name = {}
+        self.__connections_by_id = {}
+        self.__connections_by_name = {}
+        self.__events_by_name = {}
+
+        # reverse indexes
+        self.__modules_by_node = {}
+        self.__connections_by_module = {}
+        self.__events_by_module = {}
+
+
+    def add_node(self, node):
+        if node.name in self.__nodes_by_name:
+            raise Error('Duplicate node name {}'.format(node.name))
+
+        self.nodes.append(node)
+        self.__nodes_by_name[node.name] = node
+        self.__modules_by_node[node.name] = []
+
+
+    def add_module(self, module):
+        if module.name in self.__modules_by_name:
+            raise Error('Duplicate module name {}'.format(module.name))
+
+        self.modules.append(module)
+        self.__modules_by_name[module.name] = module
+        self.__modules_by_node[module.node.name].append(module)
+        self.__connections_by_module[module.name] = []
+        self.__events_by_module[module.name] = []
+
+
+    def add_connection(self, conn):
+        if conn.id in self.__connections_by_id:
+            raise Error('Duplicate connection ID {}'.format(conn.id))
+        if conn.name in self.__connections_by_name:
+            raise Error('Duplicate connection name {}'.format(conn.name))
+
+        self.connections.append(conn)
+        self.__connections_by_id[conn.id] = conn
+        self.__connections_by_name[conn.name] = conn
+
+        if conn.from_module is not None:
+            self.__connections_by_module[conn.from_module.name].append(conn)
+        if conn.to_module is not conn.from_module:
+            self.__connections_by_module[conn.to_module.name].append(conn)
+
+
+    def add_periodic_event(self, event):
+        if event.name in self.__events_by_name:
+            raise Error('Duplicate periodic event name {}'.format(event.name))
+
+        self.periodic_events.append(event)
+        self.__events_by_name[event.name] = event
+        self.__events_by_module[event.module.name].append(event)
+
 
     def get_node(self, name):
-        for n in self.nodes:
-            if n.name == name:
-                return n
+        try:
+            return self.__nodes_by_name[name]
+        except KeyError:
+            pass
+
+        obj = self.__load_lazy("nodes", "name", name)
+        if obj is None:
+            raise Error('No node with name {}'.format(name))
+
+        return obj
 
-        raise Error('No node with name {}'.format(name))
 
     def get_module(self, name):
-        for m in self.modules:
-            if m.name == name:
-                return m
+        try:
+            return self.__modules_by_name[name]
+        except KeyError:
+            pass
+
+        obj = self.__load_lazy("modules", "name", name)
+        if obj is None:
+            raise Error('No module with name {}'.format(name))
 
-        raise Error('No module with name {}'.format(name))
+        return obj
 
 
     def get_connection_by_id(self, id):
-        for c in self.connections:
-            if c.id == id:
-                return c
+        try:
+            return self.__connections_by_id[id]
+        except KeyError:
+            pass
+
+        obj = self.__load_lazy("connections", "id", id)
+        if obj is None:
+            raise Error('No connection with ID {}'.format(id))
 
-        raise Error('No connection with ID {}'.format(id))
+        return obj
 
 
     def get_connection_by_name(self, name):
-        for c in self.connections:
-            if c.name == name:
-                return c
+        try:
+            return self.__connections_by_name[name]
+        except KeyError:
+            pass
+
+        obj = self.__load_lazy("connections", "name", name)
+        if obj is None:
+            raise Error('No connection with name {}'.format(name))
+
+        return obj
+
+
+    # `conn` is either the ID or the name of the connection
+    def get_connection(self, conn):
+        if isinstance(conn, int) or conn.isnumeric():
+            return self.get_connection_by_id(int(conn))
 
-        raise Error('No connection with name {}'.format(name))
+        return self.get_connection_by_name(conn)
 
 
     def get_periodic_event(self, name):
-        for e in self.periodic_events:
-            if e.name == name:
-                return e
+        try:
+            return self.__events_by_name[name]
+        except KeyError:
+            pass
+
+        obj = self.__load_lazy("periodic-events", "name", name)
+        if obj is None:
+            raise Error('No periodic event with name {}'.format(name))
+
+        return obj
+
+
+    def __load_lazy(self, section, key, value):
+        if self.lazy_contents is None:
+            return None
+
+        obj_dict = self.lazy_contents.get(section, key, value)
+        if obj_dict is None:
+            return None
+
+        check, load, add = _LAZY_LOADERS[section]
+
+        what = "{} {}".format(section, value)
+        _raise_broken_rules(check(obj_dict, what))
+
+        obj = load(obj_dict, self)
+        add(self, obj)
+        logging.debug("Loaded {}".format(what))
+
+        return obj
+
+
+    def get_modules_of_node(self, node):
+        return self.__modules_by_node[node.name]
+
+
+    def get_connections_of_module(self, module):
+        return self.__connections_by_module[module.name]
+
+
+    def get_periodic_events_of_module(self, module):
+        return self.__events_by_module[module.name]
+
+
+    # Record the failure of `operation` (e.g., "deploy") on a module,
+    # connection or periodic event, written in the deployment descriptor
+    def add_failure(self, obj, operation, error):
+        error = str(error) or type(error).__name__
+        logging.warning("{} of {} failed: {}".format(operation, obj.name, error))
+
+        self.failures.append({
+            "section": _section_of(obj),
+            "name": obj.name,
+            "operation": operation,
+            "error": error
+        })
+        self.__failed_objects.add((_section_of(obj), obj.name))
+
 
-        raise Error('No periodic event with name {}'.format(name))
+    def clear_failures(self):
+        self.failures = []
+        self.__failed_objects.clear()
+
+
+    # Await `coro`, an operation on `obj`. With continue-on-error, a failure
+    # is recorded instead of being raised, so that the other objects go on
+    async def __try(self, operation, obj, coro):
+        if not glob.get_continue_on_error():
+            return await coro
+
+        try:
+            await coro
+        except Exception as e:
+            self.add_failure(obj, operation, e)
+
+
+    async def __run_all(self, operation, objs, coro_fn):
+        futures = [self.__try(operation, o, coro_fn(o)) for o in objs]
+        await asyncio.gather(*futures)
+
+
+    # Objects not ready for `operation` (e.g., modules to attest that are not
+    # deployed) are skipped and recorded with continue-on-error
+    def __filter_ready(self, operation, objs, is_ready, error):
+        not_ready = [o for o in objs if not is_ready(o)]
+
+        if not not_ready:
+            return objs
+
+        if not glob.get_continue_on_error():
+            raise Error(error)
+
+        for o in not_ready:
+            self.add_failure(o, operation, error)
+
+        return [o for o in objs if is_ready(o)]
 
 
     async def deploy_priority_modules(self):
@@ -76,7 +287,7 @@ class Config:
 
         logging.debug("Priority modules: {}".format([sm.name for sm in priority_modules]))
         for module in priority_modules:
-            await module.deploy()
+            await self.__try("deploy", module, module.deploy())
 
 
     async def deploy_async(self, in_order, module):
@@ -96,20 +307,36 @@ class Config:
         # If deployment in order is desired, deploy one module at a time
         if in_order:
             for module in self.modules:
-                if not module.deployed:
-                    await module.deploy()
+                if not module.deployed and not self.__failed(module):
+                    await self.__try("deploy", module, module.deploy())
         # Otherwise, deploy all modules concurrently
         else:
-            lst = self.modules
-            l_filter = lambda x : not x.deployed
-            l_map = lambda x : x.deploy()
+            await asyncio.gather(*map(self.__deploy_node, self.nodes))
+
 
-            futures = map(l_map, filter(l_filter, lst))
-            await asyncio.gather(*futures)
+    # Deploy the modules of `node` concurrently: the node limits the commands
+    # and bytes in flight (see Node._send_deploy_command)
+    async def __deploy_node(self, node):
+        lst = self.get_modules_of_node(node)
+        l_filter = lambda x : not x.deployed and not self.__failed(x)
+        l_map = lambda x : x.deploy()
+
+        to_deploy = list(filter(l_filter, lst))
+        if to_deploy:
+            logging.debug("Deploying {} module(s) on {}".format(len(to_deploy),
+                            node.name))
+
+        await self.__run_all("deploy", to_deploy, l_map)
+
+
+    # e.g., priority modules that failed are not deployed again
+    def __failed(self, obj):
+        return (_section_of(obj), obj.name) in self.__failed_objects
 
 
     def deploy(self, in_order, module):
         asyncio.get_event_loop().run_until_complete(self.deploy_async(in_order, module))
+        tools.log_job_waits()
 
 
     async def build_async(self, module):
@@ -121,6 +348,7 @@ class Config:
 
     def build(self, module):
         asyncio.get_event_loop().run_until_complete(self.build_async(module))
+        tools.log_job_waits()
 
 
     async def attest_async(self, module):
@@ -128,13 +356,13 @@ class Config:
 
         to_attest = list(filter(lambda x : not x.attested, lst))
 
-        if any(map(lambda x : not x.deployed, to_attest)):
-            raise Error("One or more modules to attest are not deployed yet")
+        to_attest = self.__filter_ready("attest", to_attest,
+            lambda x : x.deployed,
+            "One or more modules to attest are not deployed yet")
 
         logging.info("To attest: {}".format([x.name for x in to_attest]))
 
-        futures = map(lambda x : x.attest(), to_attest)
-        await asyncio.gather(*futures)
+        await self.__run_all("attest", to_attest, lambda x : x.attest())
 
 
     def attest(self, module):
@@ -146,16 +374,45 @@ class Config:
 
         to_connect = list(filter(lambda x : not x.established, lst))
 
-        if any(map(
-            lambda x : (x.from_module and not x.from_module.attested) or
-            not x.to_module.attested,
-        to_connect)):
-            raise Error("One or more modules to connect are not attested yet")
+        to_connect = self.__filter_ready("connect", to_connect,
+            lambda x : (not x.from_module or x.from_module.attested) and
+            x.to_module.attested,
+            "One or more modules to connect are not attested yet")
 
         logging.info("To connect: {}".format([x.name for x in to_connect]))
 
-        futures = map(lambda x : x.establish(), to_connect)
-        await asyncio.gather(*futures)
+        await self.__establish_all(to_connect)
+
+
+    # Each set_key uses the next nonce of its module, which must receive them
+    # in order: the connections of a module are established one after the
+    # other, in the order of get_connections_of_module, while those of
+    # different modules are established concurrently
+    async def __establish_all(self, to_connect):
+        selected = set(to_connect)
+        previous = {conn: [] for conn in to_connect}
+        modules = {m for conn in to_connect
+                        for m in [conn.from_module, conn.to_module] if m is not None}
+
+        for module in modules:
+            chain = [c for c in self.get_connections_of_module(module) if c in selected]
+            for prev, conn in zip(chain, chain[1:]):
+                previous[conn].append(prev)
+
+        tasks = {}
+
+        async def establish(conn):
+            for prev in previous[conn]:
+                # the nonce of a failed set_key might have been used anyway
+                await asyncio.wait([tasks[prev]])
+
+            await conn.establish()
+
+        for conn in to_connect:
+            tasks[conn] = asyncio.ensure_future(
+                                self.__try("connect", conn, establish(conn)))
+
+        await asyncio.gather(*tasks.values())
 
 
     def connect(self, conn):
@@ -167,79 +424,209 @@ class Config:
 
         to_register = list(filter(lambda x : not x.established, lst))
 
-        if any(map(lambda x : not x.module.attested, to_register)):
-            raise Error("One or more modules are not attested yet")
+        to_register = self.__filter_ready("register", to_register,
+            lambda x : x.module.attested,
+            "One or more modules are not attested yet")
 
         logging.info("To register: {}".format([x.name for x in to_register]))
 
-        futures = map(lambda x : x.register(), to_register)
-        await asyncio.gather(*futures)
+        await self.__run_all("register", to_register, lambda x : x.register())
 
 
     def register_event(self, event):
         asyncio.get_event_loop().run_until_complete(self.register_async(event))
 
 
+    # Returns the payload of the response
+    async def call_async(self, module, entry, arg=None):
+        return await self.get_module(module).call(entry, arg)
+
+
+    # Trigger the output of a direct connection, returning the connection.
+    # Outputs and requests of the same connection are sent one at a time,
+    # since each of them uses the next nonce of the connection
+    async def output_async(self, conn, arg=None):
+        conn = self.__get_direct_connection(conn)
+
+        if not conn.to_input:
+            raise Error("Not a output-input connection")
+
+        async with self.__get_nonce_lock(conn):
+            await self.__reserve_nonce(conn, 1)
+
+            try:
+                await conn.to_module.node.output(conn, arg)
+            except:
+                await self.__release_nonce(conn, 1)
+                raise
+
+            conn.nonce += 1
+
+        return conn
+
+
+    # Trigger the request of a direct connection, returning the connection
+    # and the payload of the response
+    async def request_async(self, conn, arg=None):
+        conn = self.__get_direct_connection(conn)
+
+        if not conn.to_handler:
+            raise Error("Not a request-handler connection")
+
+        async with self.__get_nonce_lock(conn):
+            await self.__reserve_nonce(conn, 2)
+
+            try:
+                response = await conn.to_module.node.request(conn, arg)
+            except:
+                await self.__release_nonce(conn, 2)
+                raise
+
+            conn.nonce += 2
+
+        return conn, response
+
+
+    def __get_direct_connection(self, conn):
+        conn = self.get_connection(conn)
+
+        if not conn.direct:
+            raise Error("Connection is not direct.")
+
+        return conn
+
+
+    def __get_nonce_lock(self, conn):
+        if conn.id not in self.__nonce_locks:
+            self.__nonce_locks[conn.id] = asyncio.Lock()
+
+        return self.__nonce_locks[conn.id]
+
+
+    # Take the next `count` nonces of `conn` from the nonce store, if any.
+    # The store waits for the other processes holding the database, so it is
+    # accessed from the executor
+    async def __reserve_nonce(self, conn, count):
+        if self.nonce_store is None:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        if self.nonce_ranges is None:
+            conn.nonce = await loop.run_in_executor(None,
+                    store.reserve_nonce, self.nonce_store, conn.name, count)
+            return
+
+        # reserved in advance: a bigger range each time the previous one is
+        # used up. A connection always takes the same number of nonces, so
+        # nothing is left of the previous range
+        r = self.nonce_ranges.get(conn.name)
+
+        if r is None or r[0] + count > r[1]:
+            size = count if r is None else \
+                   min(2 * r[2], MAX_NONCE_RESERVATION * count)
+            first = await loop.run_in_executor(None,
+                    store.reserve_nonce, self.nonce_store, conn.name, size)
+            r = self.nonce_ranges[conn.name] = [first, first + size, size]
+
+        conn.nonce = r[0]
+        r[0] += count
+
+
+    async def __release_nonce(self, conn, count):
+        if self.nonce_store is None:
+            return
+
+        if self.nonce_ranges is not None:
+            self.nonce_ranges[conn.name][0] -= count
+            return
+
+        await asyncio.get_event_loop().run_in_executor(None,
+                store.release_nonce, self.nonce_store, conn.name,
+                conn.nonce, count)
+
+
     async def cleanup_async(self):
-        coros = list(map(lambda c: c(), node_cleanup_coros + module_cleanup_coros))
+        # only the architectures that have been used need a cleanup
+        classes = node_registry.loaded() + module_registry.loaded()
+        coros = list(map(lambda c: c.cleanup(), classes))
         await asyncio.gather(*coros)
 
 
     def cleanup(self):
         asyncio.get_event_loop().run_until_complete(self.cleanup_async())
 
+        for node in self.nodes:
+            node.log_stats()
+
+        tools.shutdown_process_pool()
+        tools.shutdown_jobserver()
+        pool.close_all()
+
 
-def load(file_name, output_type=None):
+# If lazy is True, objects are not validated and built until they are used,
+# through the get_* methods of Config. Useful for commands that only need a
+# few objects, e.g., call, output and request
+def load(file_name, output_type=None, lazy=False):
     config = Config()
     desc_type = DescriptorType.from_str(output_type)
 
-    contents, input_type = DescriptorType.load_any(file_name)
+    if lazy and os.path.exists(file_name) and \
+            DescriptorType.detect(file_name) == DescriptorType.SQLITE:
+        # rows are fetched from the database only when needed
+        contents, input_type = store.load_meta(file_name), DescriptorType.SQLITE
+        config.lazy_contents = _StoreContents(file_name)
+    else:
+        contents, input_type = DescriptorType.load_any(file_name)
 
     # Output file format is:
     #   - desc_type if has been provided as input, or
     #   - the same type of the input file otherwise
-    config.output_type = desc_type or input_type
-
-    config.nodes = load_list(contents['nodes'],
-                                lambda n: _load_node(n, config))
-    config.modules = load_list(contents['modules'],
-                                lambda m: _load_module(m, config))
-
+    config.output_type = desc_type if desc_type is not None else input_type
+    config.input_file = os.path.abspath(file_name)
+    config.input_type = input_type
+
+    # Only descriptors written by us are guaranteed to name all their objects,
+    # which is needed to apply incremental updates (see update_config).
+    # SQLite descriptors are updated in place and do not need a journal
+    if 'connections_current_id' in contents and \
+            input_type != DescriptorType.SQLITE:
+        config.journal_entries = journal.replay(file_name, contents)
+
+    config.journal_generation = contents.get(journal.GENERATION) or 0
     config.connections_current_id = contents.get('connections_current_id') or 0
     config.events_current_id = contents.get('events_current_id') or 0
 
-    if 'connections' in contents:
-        config.connections = load_list(contents['connections'],
-                                        lambda c: _load_connection(c, config))
-    else:
-        config.connections = []
+    if lazy:
+        if config.lazy_contents is None:
+            config.lazy_contents = _Contents(contents)
 
-    if 'periodic-events' in contents:
-        config.periodic_events = load_list(contents['periodic-events'],
-                                        lambda e: _load_periodic_event(e, config))
-    else:
-        config.periodic_events = []
+        return config
+
+    check_rules(contents)
+
+    for n in load_list(contents['nodes']):
+        config.add_node(_load_node(n, config))
+
+    for m in load_list(contents['modules']):
+        config.add_module(_load_module(m, config))
+
+    for c in load_list(contents.get('connections')):
+        config.add_connection(_load_connection(c, config))
+
+    for e in load_list(contents.get('periodic-events')):
+        config.add_periodic_event(_load_periodic_event(e, config))
 
     return config
 
 
 def _load_node(node_dict, config):
-    # Basic rules common to all nodes
-    evaluate_rules(os.path.join("default", "node.yaml"), node_dict)
-    # Specific rules for a specific node type
-    evaluate_rules(os.path.join("nodes", node_rules[node_dict['type']]), node_dict)
-
-    return node_funcs[node_dict['type']](node_dict)
+    return node_registry.get(node_dict['type']).load(node_dict)
 
 
 def _load_module(mod_dict, config):
-    # Basic rules common to all nodes
-    evaluate_rules(os.path.join("default", "module.yaml"), mod_dict)
-    # Specific rules for a specific node type
-    evaluate_rules(os.path.join("modules", module_rules[mod_dict['type']]), mod_dict)
-
     node = config.get_node(mod_dict['node'])
-    module = module_funcs[mod_dict['type']](mod_dict, node)
+    module = module_registry.get(mod_dict['type']).load(mod_dict, node)
 
     if node.__class__ not in module.get_supported_nodes():
         raise Error("Node {} ({}) does not support module {} ({})".format(
@@ -250,50 +637,282 @@ def _load_module(mod_dict, config):
 
 
 def _load_connection(conn_dict, config):
-    evaluate_rules(os.path.join("default", "connection.yaml"), conn_dict)
     return Connection.load(conn_dict, config)
 
 
 def _load_periodic_event(events_dict, config):
-    evaluate_rules(os.path.join("default", "periodic_event.yaml"), events_dict)
     return PeriodicEvent.load(events_dict, config)
 
 
-def evaluate_rules(rules_file, dict):
-    rules = load_rules(rules_file)
+def check_rules(contents):
+    # All the objects are checked before raising, so that every broken rule
+    # of the deployment descriptor is reported at once
+    errors = []
 
-    ok = True
+    for i, n in enumerate(load_list(contents.get('nodes'))):
+        errors += _check_node(n, "node {}".format(n.get('name', i)))
+
+    for i, m in enumerate(load_list(contents.get('modules'))):
+        errors += _check_module(m, "module {}".format(m.get('name', i)))
+
+    for i, c in enumerate(load_list(contents.get('connections'))):
+        errors += _check_connection(c, "connection {}".format(c.get('name', i)))
+
+    for i, e in enumerate(load_list(contents.get('periodic-events'))):
+        errors += _check_periodic_event(e, "event {}".format(e.get('name', i)))
+
+    _raise_broken_rules(errors)
+
+
+def _raise_broken_rules(errors):
+    if errors:
+        for e in errors:
+            logging.error(e)
+
+        raise Error("Bad deployment descriptor: {} broken rule(s)".format(len(errors)))
+
+
+def _check_node(node_dict, what):
+    # Basic rules common to all nodes
+    errors = _broken_rules(os.path.join("default", "node.yaml"), node_dict, what)
+
+    # Specific rules for a specific node type
+    type = node_dict.get('type')
+    if not isinstance(type, str):
+        pass # already reported by the basic rules
+    elif type in node_registry:
+        rules = node_registry.get_rules(type)
+        if rules is not None:
+            errors += _broken_rules(os.path.join("nodes", rules), node_dict, what)
+    else:
+        errors.append("{} - Unknown node type: {}".format(what, type))
+
+    return errors
+
+
+def _check_module(mod_dict, what):
+    # Basic rules common to all modules
+    errors = _broken_rules(os.path.join("default", "module.yaml"), mod_dict, what)
+
+    # Specific rules for a specific module type
+    type = mod_dict.get('type')
+    if not isinstance(type, str):
+        pass # already reported by the basic rules
+    elif type in module_registry:
+        rules = module_registry.get_rules(type)
+        if rules is not None:
+            errors += _broken_rules(os.path.join("modules", rules), mod_dict, what)
+    else:
+        errors.append("{} - Unknown module type: {}".format(what, type))
+
+    return errors
+
+
+def _check_connection(conn_dict, what):
+    return _broken_rules(os.path.join("default", "connection.yaml"), conn_dict, what)
+
+
+def _check_periodic_event(event_dict, what):
+    return _broken_rules(os.path.join("default", "periodic_event.yaml"), event_dict, what)
 
-    for r in rules:
-        try:
-            result = eval(rules[r])
-        except:
-            result = False
 
-        if not result:
-            logging.error("{} - Broken rule: {}".format(rules_file, r))
-            ok = False
+def _broken_rules(rules_file, dict, what):
+    return ["{} ({}) - Broken rule: {}".format(rules_file, what, r)
+                for r in evaluate_rules(rules_file, dict)]
 
-    if not ok:
-        raise Error("Bad deployment descriptor")
+
+# section -> (rules check, load function, Config method to add the object)
+_LAZY_LOADERS = {
+    'nodes'             : (_check_node, _load_node, Config.add_node),
+    'modules'           : (_check_module, _load_module, Config.add_module),
+    'connections'       : (_check_connection, _load_connection, Config.add_connection),
+    'periodic-events'   : (_check_periodic_event, _load_periodic_event, Config.add_periodic_event)
+}
+
+
+# Raw contents of a descriptor, indexed on demand
+class _Contents:
+    def __init__(self, contents):
+        self.__contents = contents
+        self.__indexes = {}
+
+
+    def get(self, section, key, value):
+        if (section, key) not in self.__indexes:
+            self.__indexes[(section, key)] = \
+                {o.get(key): o for o in self.get_all(section)}
+
+        return self.__indexes[(section, key)].get(value)
+
+
+    def get_all(self, section):
+        return load_list(self.__contents.get(section))
+
+
+# Raw contents of a SQLite descriptor, read one row at a time
+class _StoreContents:
+    def __init__(self, file_name):
+        self.__file_name = file_name
+
+
+    def get(self, section, key, value):
+        return store.get_object(self.__file_name, section, key, value)
+
+
+    def get_all(self, section):
+        return store.load(self.__file_name)[section]
 
 
 def dump_config(config, file_name):
-    config.output_type.dump(file_name, dump(config))
+    # entries appended to the journal so far are not replayed on top of the
+    # new descriptor, even if removing the journal below fails
+    config.journal_generation += 1
+    _write_config(config, dump(config), file_name)
+
+
+# Coroutine. Same as dump_config, to be used while the event loop is running
+async def dump_config_async(config, file_name):
+    config.journal_generation += 1
+    _write_config(config, await dump_async(config), file_name)
+
+
+def _write_config(config, contents, file_name):
+    config.output_type.dump(file_name, contents)
+
+    # the descriptor now includes all the updates in the journal
+    journal.remove(file_name)
+
+    if os.path.abspath(file_name) == config.input_file:
+        config.journal_entries = 0
+
+
+# Persist the state of `objects`, assuming that nothing else in `config` has
+# changed since it was loaded. If the output file is the input descriptor,
+# only the changed state is written: SQLite descriptors update the rows of
+# the objects, other descriptors append the changes to their journal, which is
+# compacted when it grows too big. Otherwise, the whole descriptor is written.
+def update_config(config, objects, file_name):
+    if _needs_dump(config, objects, file_name):
+        dump_config(config, file_name)
+    else:
+        _write_entries(config, [_journal_entry(o, dump(o)) for o in objects],
+                       file_name)
+
+
+# Coroutine. Same as update_config, to be used while the event loop is running
+async def update_config_async(config, objects, file_name):
+    if _needs_dump(config, objects, file_name):
+        await dump_config_async(config, file_name)
+    else:
+        _write_entries(config, [_journal_entry(o, await dump_async(o))
+                                    for o in objects], file_name)
+
+
+def _needs_dump(config, objects, file_name):
+    # failures are recorded in the whole descriptor
+    if config.failures:
+        return True
+
+    if not _is_input(config, file_name):
+        return True
+
+    if config.input_type == DescriptorType.SQLITE:
+        return False
+
+    return config.journal_entries is None or \
+           config.journal_entries + len(objects) > journal.MAX_ENTRIES
+
+
+def _write_entries(config, entries, file_name):
+    if config.input_type == DescriptorType.SQLITE:
+        # reserved nonces are already in the database, and other processes
+        # might have reserved more since. Nonces reserved in advance and not
+        # used are given back, if possible
+        if config.nonce_store is not None:
+            reserved = {name: r[1]
+                            for name, r in (config.nonce_ranges or {}).items()}
+            store.update(file_name, entries, reserved)
+        else:
+            store.update(file_name, entries)
+        return
+
+    journal.append(file_name, entries, config.journal_generation)
+    config.journal_entries += len(entries)
+
+
+# If the result is written in place to a SQLite descriptor, reserve the nonces
+# of direct connections in the database before using them (see
+# Config.output_async), so that concurrent invocations never use the same nonce.
+# With `in_advance`, each connection reserves a range of nonces that are used
+# in memory, and the next nonce is written back by update_config
+def reserve_nonces(config, file_name, in_advance=False):
+    if _is_input(config, file_name) and \
+            config.input_type == DescriptorType.SQLITE:
+        config.nonce_store = config.input_file
+
+        if in_advance:
+            config.nonce_ranges = {}
+
+
+def _is_input(config, file_name):
+    return os.path.abspath(file_name) == config.input_file and \
+           config.output_type == config.input_type
+
+
+# Convert a deployment descriptor to another format, without loading it
+def convert(file_name, out_file, output_type):
+    contents, input_type = DescriptorType.load_any(file_name)
+
+    if input_type != DescriptorType.SQLITE:
+        journal.replay(file_name, contents)
+
+    DescriptorType.from_str(output_type).dump(out_file, contents)
+    journal.remove(out_file)
+
+
+def _section_of(obj):
+    if isinstance(obj, Module):
+        return 'modules'
+    if isinstance(obj, Connection):
+        return 'connections'
+    if isinstance(obj, PeriodicEvent):
+        return 'periodic-events'
+
+    raise Error("No section for objects of type {}".format(type(obj).__name__))
+
+
+def _journal_entry(obj, obj_dict):
+    return journal.make_entry(_section_of(obj), obj.name, obj_dict)
 
 
 @dump.register(Config)
 def _(config):
-    dump(config.nodes)
-    return {
-            'nodes': dump(config.nodes),
-            'modules': dump(config.modules),
+    contents = {
+            'nodes': _dump_section(config, 'nodes', config.nodes),
+            'modules': _dump_section(config, 'modules', config.modules),
             'connections_current_id': config.connections_current_id,
-            'connections': dump(config.connections),
+            'connections': _dump_section(config, 'connections', config.connections),
             'events_current_id': config.events_current_id,
-            'periodic-events' : dump(config.periodic_events)
+            'periodic-events' : _dump_section(config, 'periodic-events', config.periodic_events),
+            journal.GENERATION: config.journal_generation
         }
 
+    # only the failures of the last run are kept
+    if config.failures:
+        contents['failures'] = config.failures
+
+    return contents
+
+
+def _dump_section(config, section, objs):
+    if config.lazy_contents is None:
+        return dump(objs)
+
+    # objects that have not been loaded are written back as they are
+    loaded = {o.name: o for o in objs}
+    return [dump(loaded[d.get('name')]) if d.get('name') in loaded else d
+                for d in config.lazy_contents.get_all(section)]
+
 
 @dump.register(Node)
 def _(node):
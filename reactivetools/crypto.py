@@ -1,7 +1,6 @@
 import base64
 import asyncio
 from enum import IntEnum
-from Crypto.Cipher import AES
 
 from . import tools
 from . import glob
@@ -56,6 +55,8 @@ class Encryption(IntEnum):
 
 
 async def encrypt_aes(key, ad, data=[]):
+    from Crypto.Cipher import AES
+
     # Note: we set nonce to zero because our nonce is part of the associated data
     aes_gcm = AES.new(key, AES.MODE_GCM, nonce=b'\x00'*12)
     aes_gcm.update(ad)
@@ -65,6 +66,8 @@ async def encrypt_aes(key, ad, data=[]):
 
 
 async def decrypt_aes(key, ad, data=[]):
+    from Crypto.Cipher import AES
+
     try:
         aes_gcm = AES.new(key, AES.MODE_GCM, nonce=b'\x00'*12)
         aes_gcm.update(ad)
@@ -0,0 +1,246 @@
+import asyncio
+import binascii
+import json
+import logging
+import os
+import signal
+
+from . import client
+from . import config
+from . import tools
+
+# Deployment daemon (`reactive-tools serve`)
+#
+# The daemon keeps a deployment descriptor loaded, together with the state of
+# its modules (e.g., keys, binaries, symbols) and the connections to the event
+# managers, and runs the commands received on a local Unix socket, so that
+# each command does not need to load everything again.
+#
+# Requests and responses are JSON objects, one per line, e.g.:
+#   {"command": "call", "module": "sm1", "entry": "entry", "arg": "0a0b"}
+#   {"ok": true, "response": "0c0d"}
+#   {"ok": false, "error": "No module with name sm1"}
+#
+# Byte arrays (arguments and responses) are hex strings. Requests may include
+# the descriptor they refer to ("config"), and the file to write the
+# resulting descriptor to ("result"), as absolute paths. The daemon owns the
+# descriptor: it is written after each command that changes it.
+
+class Error(Exception):
+    pass
+
+
+class Server():
+    def __init__(self, conf, out_file):
+        self.conf = conf
+        self.out_file = os.path.abspath(out_file)
+        self.__stop = None
+
+        # held by the requests that record their failures in self.conf
+        self.__lock = None
+
+        # see client.COMMANDS
+        self.__handlers = {
+            "deploy"    : self.__deploy,
+            "attest"    : self.__attest,
+            "connect"   : self.__connect,
+            "register"  : self.__register,
+            "call"      : self.__call,
+            "output"    : self.__output,
+            "request"   : self.__request,
+            "shutdown"  : self.__shutdown
+        }
+
+
+    # Coroutine. Serves requests on `path` until stop() is called, or the
+    # daemon receives SIGINT or SIGTERM
+    async def serve(self, path):
+        loop = asyncio.get_event_loop()
+        self.__stop = loop.create_future()
+        self.__lock = asyncio.Lock()
+
+        if os.path.exists(path):
+            if client.is_listening(path):
+                raise Error("A daemon is already listening on {}".format(path))
+
+            # left by a daemon that did not exit cleanly
+            os.unlink(path)
+
+        server = await asyncio.start_unix_server(self.__handle_client, path)
+        os.chmod(path, 0o600)
+
+        signals = [signal.SIGINT, signal.SIGTERM]
+        for sig in signals:
+            loop.add_signal_handler(sig, self.stop)
+
+        logging.info("Serving {} on {}".format(self.conf.input_file, path))
+
+        try:
+            await self.__stop
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+
+            server.close()
+            await server.wait_closed()
+            os.unlink(path)
+
+
+    def stop(self):
+        if self.__stop is not None and not self.__stop.done():
+            self.__stop.set_result(None)
+
+
+    async def __handle_client(self, reader, writer):
+        # requests of a client are handled one at a time, in order
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                response = await self.__handle_request(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def __handle_request(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise Error("Bad request: {}".format(line))
+
+            command = request.get("command")
+            if command not in self.__handlers:
+                raise Error("Unknown command: {}".format(command))
+
+            config_file = request.get("config")
+            if config_file is not None and \
+                    os.path.abspath(config_file) != self.conf.input_file:
+                raise Error("The daemon serves {}, not {}".format(
+                                self.conf.input_file, config_file))
+
+            logging.debug("Request: {}".format(request))
+
+            if command in ["deploy", "attest", "connect", "register"]:
+                # one at a time, each with its own failures
+                async with self.__lock:
+                    self.conf.clear_failures()
+                    result = await self.__handlers[command](request)
+            else:
+                result = await self.__handlers[command](request)
+
+            return dict(result or {}, ok=True)
+        except Exception as e:
+            logging.error(e)
+            return {"ok": False, "error": str(e) or type(e).__name__}
+
+
+    def __get_out_file(self, request):
+        return request.get("result") or self.out_file
+
+
+    async def __deploy(self, request):
+        await self.conf.deploy_async(request.get("in_order", False),
+                                     request.get("module"))
+        tools.log_job_waits()
+
+        await config.dump_config_async(self.conf, self.__get_out_file(request))
+        return {"failures": self.conf.failures}
+
+
+    async def __attest(self, request):
+        module = request.get("module")
+
+        await self.conf.attest_async(module)
+
+        out_file = self.__get_out_file(request)
+        if module:
+            await config.update_config_async(self.conf,
+                                    [self.conf.get_module(module)], out_file)
+        else:
+            await config.dump_config_async(self.conf, out_file)
+
+        return {"failures": self.conf.failures}
+
+
+    async def __connect(self, request):
+        name = request.get("connection")
+
+        await self.conf.connect_async(name)
+
+        out_file = self.__get_out_file(request)
+        if name:
+            # set_key also updates the nonces of the modules involved
+            conn = self.conf.get_connection_by_name(name)
+            modules = [m for m in [conn.from_module, conn.to_module] if m is not None]
+            await config.update_config_async(self.conf, [conn] + modules,
+                                             out_file)
+        else:
+            await config.dump_config_async(self.conf, out_file)
+
+        return {"failures": self.conf.failures}
+
+
+    async def __register(self, request):
+        event = request.get("event")
+
+        await self.conf.register_async(event)
+
+        out_file = self.__get_out_file(request)
+        if event:
+            await config.update_config_async(self.conf,
+                                    [self.conf.get_periodic_event(event)], out_file)
+        else:
+            await config.dump_config_async(self.conf, out_file)
+
+        return {"failures": self.conf.failures}
+
+
+    async def __call(self, request):
+        response = await self.conf.call_async(_get(request, "module"),
+                                              _get(request, "entry"),
+                                              _get_arg(request))
+
+        return {"response": _hexlify(response)}
+
+
+    async def __output(self, request):
+        conn = await self.conf.output_async(_get(request, "connection"),
+                                            _get_arg(request))
+
+        await config.update_config_async(self.conf, [conn],
+                                         self.__get_out_file(request))
+
+
+    async def __request(self, request):
+        conn, response = await self.conf.request_async(
+                                _get(request, "connection"), _get_arg(request))
+
+        await config.update_config_async(self.conf, [conn],
+                                         self.__get_out_file(request))
+        return {"response": _hexlify(response)}
+
+
+    async def __shutdown(self, request):
+        self.stop()
+
+
+def _get(request, key):
+    if request.get(key) is None:
+        raise Error("Missing {} in request".format(key))
+
+    return request[key]
+
+
+def _get_arg(request):
+    arg = request.get("arg")
+    return None if arg is None else binascii.unhexlify(arg)
+
+
+def _hexlify(data):
+    return None if data is None else binascii.hexlify(data).decode('ascii')
@@ -1,8 +1,35 @@
 import json
 import yaml
 import os
+import binascii
 from enum import IntEnum
 
+from . import glob
+
+# Use the libyaml bindings if available, much faster than the pure-Python ones
+try:
+    from yaml import CFullLoader as YAMLLoader, CDumper as YAMLDumper
+except ImportError:
+    from yaml import FullLoader as YAMLLoader, Dumper as YAMLDumper
+
+
+def hexlify(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return binascii.hexlify(obj).decode('ascii')
+
+    raise TypeError("Object of type {} is not JSON serializable".format(
+                        type(obj).__name__))
+
+
+# Keys are dumped as raw bytes, text descriptors store them as hex strings
+class _YAMLDumper(YAMLDumper):
+    pass
+
+_YAMLDumper.add_representer(bytes,
+                lambda dumper, b: dumper.represent_str(hexlify(b)))
+_YAMLDumper.add_representer(bytearray,
+                lambda dumper, b: dumper.represent_str(hexlify(b)))
+
 
 class Error(Exception):
     pass
@@ -11,6 +38,8 @@ class Error(Exception):
 class DescriptorType(IntEnum):
     JSON    = 0
     YAML    = 1
+    BINARY  = 2 # MessagePack
+    SQLITE  = 3
 
     @staticmethod
     def from_str(type):
@@ -23,37 +52,119 @@ class DescriptorType(IntEnum):
             return DescriptorType.JSON
         if type_lower == "yaml":
             return DescriptorType.YAML
+        if type_lower == "binary":
+            return DescriptorType.BINARY
+        if type_lower == "sqlite":
+            return DescriptorType.SQLITE
 
         raise Error("Bad deployment descriptor type: {}".format(type))
 
 
+    @staticmethod
+    def detect(file):
+        ext = os.path.splitext(file)[1].lower()
+
+        if ext == ".json":
+            return DescriptorType.JSON
+        if ext in [".yaml", ".yml"]:
+            return DescriptorType.YAML
+        if ext in [".msgpack", ".bin"]:
+            return DescriptorType.BINARY
+        if ext in [".db", ".sqlite"]:
+            return DescriptorType.SQLITE
+
+        with open(file, 'rb') as f:
+            head = f.read(64)
+
+        if head.startswith(b"SQLite format 3\x00"):
+            return DescriptorType.SQLITE
+
+        # a MessagePack descriptor starts with a map (fixmap, map 16, map 32)
+        if head[:1] and (0x80 <= head[0] <= 0x8f or head[0] in [0xde, 0xdf]):
+            return DescriptorType.BINARY
+
+        # otherwise, look at the first non-blank character
+        head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+
+        if head[:1] in [b'{', b'[']:
+            return DescriptorType.JSON
+
+        return DescriptorType.YAML
+
+
     @staticmethod
     def load_any(file):
         if not os.path.exists(file):
             raise Error("Input file does not exist")
 
+        type = DescriptorType.detect(file)
+
         try:
-            return DescriptorType.JSON.load(file), DescriptorType.JSON
+            return type.load(file), type
+        except Error:
+            raise
         except:
+            pass
+
+        # JSON is a subset of YAML: a JSON-looking file that fails to parse
+        # (e.g., because of trailing commas) may still be valid YAML
+        if type == DescriptorType.JSON:
             try:
                 return DescriptorType.YAML.load(file), DescriptorType.YAML
             except:
-                raise Error("Input file is not a JSON, nor a YAML")
+                pass
+
+        raise Error("Input file is not a valid deployment descriptor")
 
 
     def load(self, file):
+        if self == DescriptorType.SQLITE:
+            from . import store
+            return store.load(file)
+
+        if self == DescriptorType.BINARY:
+            msgpack = _import_msgpack()
+
+            with open(file, 'rb') as f:
+                return msgpack.unpack(f, raw=False)
+
         with open(file, 'r') as f:
             if self == DescriptorType.JSON:
                 return json.load(f)
 
             if self == DescriptorType.YAML:
-                return yaml.load(f, Loader=yaml.FullLoader)
+                return yaml.load(f, Loader=YAMLLoader)
 
 
     def dump(self, file, data):
+        if self == DescriptorType.SQLITE:
+            from . import store
+            store.dump(file, data)
+            return
+
+        if self == DescriptorType.BINARY:
+            msgpack = _import_msgpack()
+
+            with open(file, 'wb') as f:
+                msgpack.pack(data, f, use_bin_type=True)
+
+            return
+
         with open(file, 'w') as f:
             if self == DescriptorType.JSON:
-                json.dump(data, f, indent=4)
+                if glob.get_compact_output():
+                    json.dump(data, f, separators=(',', ':'), default=hexlify)
+                else:
+                    json.dump(data, f, indent=4, default=hexlify)
 
             if self == DescriptorType.YAML:
-                yaml.dump(data, f)
+                yaml.dump(data, f, Dumper=_YAMLDumper)
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except:
+        raise Error("msgpack not installed, binary descriptors are not supported")
+
+    return msgpack
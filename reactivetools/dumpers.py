@@ -1,7 +1,10 @@
 import asyncio
 import functools
 import types
-import binascii
+
+# Set while dump_async runs dump: coroutines are returned as they are, to be
+# awaited afterwards
+_defer = False
 
 @functools.singledispatch
 def dump(obj):
@@ -13,10 +16,12 @@ def _(l):
     return [dump(e) for e in l]
 
 
+# Byte arrays are kept as they are: text descriptors (JSON, YAML) encode them
+# as hex strings when writing the file, binary descriptors store them raw
 @dump.register(bytes)
 @dump.register(bytearray)
 def _(bs):
-    return binascii.hexlify(bs).decode('ascii')
+    return bytes(bs)
 
 
 @dump.register(str)
@@ -32,9 +37,44 @@ def _(t):
 
 @dump.register(types.CoroutineType)
 def _(coro):
+    if _defer:
+        return coro
+
     return dump(asyncio.get_event_loop().run_until_complete(coro))
 
 
 @dump.register(dict)
 def _(dict):
     return dict
+
+
+# Coroutine. Same as dump, but the values that are not known yet (e.g., the
+# key of a module) are awaited instead of being computed in the event loop, so
+# that it can be used while the loop is running (e.g., in the daemon)
+async def dump_async(obj):
+    global _defer
+
+    _defer = True
+    try:
+        data = dump(obj)
+    finally:
+        _defer = False
+
+    return await _resolve(data)
+
+
+_NESTED = (types.CoroutineType, dict, list)
+
+async def _resolve(data):
+    if isinstance(data, types.CoroutineType):
+        return dump(await data)
+
+    if isinstance(data, dict):
+        return {k: await _resolve(v) if isinstance(v, _NESTED) else v
+                    for k, v in data.items()}
+
+    if isinstance(data, list):
+        return [await _resolve(e) if isinstance(e, _NESTED) else e
+                    for e in data]
+
+    return data
@@ -38,3 +38,124 @@ def set_build_mode(mode):
 
 def get_build_mode():
     return __BUILD_MODE
+
+
+__COMPACT_OUTPUT = False
+
+def set_compact_output(compact):
+    global __COMPACT_OUTPUT
+    __COMPACT_OUTPUT = compact
+
+def get_compact_output():
+    return __COMPACT_OUTPUT
+
+
+# maximum number of build jobs (e.g., compilers) running at the same time
+__JOBS = os.cpu_count() or 1
+
+def set_jobs(jobs):
+    global __JOBS
+
+    if jobs < 1:
+        raise Error("Bad number of jobs: {}".format(jobs))
+
+    __JOBS = jobs
+
+def get_jobs():
+    return __JOBS
+
+
+# number of worker processes running code generators (e.g., rust-sgx-gen)
+__CODEGEN_WORKERS = os.cpu_count() or 1
+
+def set_codegen_workers(workers):
+    global __CODEGEN_WORKERS
+
+    if workers < 1:
+        raise Error("Bad number of code generation workers: {}".format(workers))
+
+    __CODEGEN_WORKERS = workers
+
+def get_codegen_workers():
+    return __CODEGEN_WORKERS
+
+
+# if True, Rust modules are built in a cargo target directory shared by all
+# the modules with the same target triple and build mode
+__SHARED_TARGET = False
+
+def set_shared_target(shared):
+    global __SHARED_TARGET
+    __SHARED_TARGET = shared
+
+def get_shared_target():
+    return __SHARED_TARGET
+
+def get_cargo_target_dir(triple):
+    if not __SHARED_TARGET:
+        return None
+
+    return os.path.join(BUILD_DIR, "cargo-target",
+                "{}-{}".format(triple, get_build_mode().to_str()))
+
+
+# maximum number of bytes of module binaries being deployed at the same time,
+# in total and to each node (None: no limit)
+__DEPLOY_BUDGET = None
+__NODE_DEPLOY_BUDGET = None
+
+def set_deploy_budget(total, per_node):
+    global __DEPLOY_BUDGET, __NODE_DEPLOY_BUDGET
+
+    for budget in [total, per_node]:
+        if budget is not None and budget < 1:
+            raise Error("Bad deploy budget: {}".format(budget))
+
+    __DEPLOY_BUDGET = total
+    __NODE_DEPLOY_BUDGET = per_node
+
+def get_deploy_budget():
+    return __DEPLOY_BUDGET
+
+def get_node_deploy_budget():
+    return __NODE_DEPLOY_BUDGET
+
+
+# seconds to wait for a node to answer a command (None: no timeout), and
+# number of times idempotent commands are sent again if a node does not answer
+__COMMAND_TIMEOUT = None
+__COMMAND_RETRIES = 3
+
+def set_command_timeout(timeout):
+    global __COMMAND_TIMEOUT
+
+    if timeout is not None and timeout <= 0:
+        raise Error("Bad command timeout: {}".format(timeout))
+
+    __COMMAND_TIMEOUT = timeout
+
+def get_command_timeout():
+    return __COMMAND_TIMEOUT
+
+def set_command_retries(retries):
+    global __COMMAND_RETRIES
+
+    if retries < 0:
+        raise Error("Bad number of retries: {}".format(retries))
+
+    __COMMAND_RETRIES = retries
+
+def get_command_retries():
+    return __COMMAND_RETRIES
+
+
+# if True, operations on many objects (e.g., deploy) go on when some of them
+# fail, and the failures are recorded in the deployment descriptor
+__CONTINUE_ON_ERROR = False
+
+def set_continue_on_error(cont):
+    global __CONTINUE_ON_ERROR
+    __CONTINUE_ON_ERROR = cont
+
+def get_continue_on_error():
+    return __CONTINUE_ON_ERROR
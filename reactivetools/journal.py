@@ -0,0 +1,108 @@
+import json
+import os
+import logging
+
+from .descriptor import hexlify
+
+# Append-only log of state changes, stored next to the deployment descriptor.
+# Each line is a JSON object like:
+#   {"section": "connections", "name": "conn0", "fields": {"nonce": 3},
+#    "generation": 2}
+# The journal is replayed on top of the descriptor when this is loaded, and is
+# removed each time the whole descriptor is written again.
+#
+# Each time it is written again, the descriptor gets a new generation, and
+# entries are tagged with the generation they apply to: if we crash after
+# writing the descriptor but before removing the journal, the stale entries
+# (which the descriptor already includes) are skipped instead of rolling the
+# state, e.g., nonces, back.
+
+SUFFIX = ".journal"
+
+# After this number of entries, the journal is compacted into the descriptor
+MAX_ENTRIES = 256
+
+# Key of the generation in the descriptor
+GENERATION = "journal_generation"
+
+# Fields that can be updated through the journal
+STATE_FIELDS = ["nonce", "deployed", "attested", "established", "key"]
+
+
+class Error(Exception):
+    pass
+
+
+def get_path(file_name):
+    return file_name + SUFFIX
+
+
+def make_entry(section, name, obj_dict):
+    fields = {k: obj_dict[k] for k in STATE_FIELDS if k in obj_dict}
+    return {"section": section, "name": name, "fields": fields}
+
+
+def append(file_name, entries, generation):
+    lines = "".join(json.dumps(dict(e, generation=generation), default=hexlify)
+                    + "\n" for e in entries)
+
+    with open(get_path(file_name), 'a') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def replay(file_name, contents):
+    path = get_path(file_name)
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, 'r') as f:
+        lines = f.readlines()
+
+    generation = contents.get(GENERATION) or 0
+    indexes = {}
+    n_entries = 0
+    n_stale = 0
+
+    for i, line in enumerate(lines):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # a partial last line means that we crashed while appending
+            if i == len(lines) - 1:
+                logging.warning("Ignoring truncated entry at the end of {}".format(path))
+                break
+            raise Error("Corrupted journal {} at line {}".format(path, i + 1))
+
+        # all entries count towards the size of the journal
+        n_entries += 1
+
+        if (entry.get("generation") or 0) < generation:
+            n_stale += 1
+            continue
+
+        section = entry["section"]
+        if section not in indexes:
+            indexes[section] = {o.get("name"): o for o in contents.get(section) or []}
+
+        obj = indexes[section].get(entry["name"])
+        if obj is None:
+            logging.warning("Journal entry for unknown object {} in {}".format(
+                            entry["name"], section))
+            continue
+
+        obj.update(entry["fields"])
+
+    if n_stale:
+        logging.warning("Skipped {} stale entries of {}".format(n_stale, path))
+
+    logging.debug("Replayed {} entries from {}".format(n_entries - n_stale, path))
+    return n_entries
+
+
+def remove(file_name):
+    try:
+        os.remove(get_path(file_name))
+    except FileNotFoundError:
+        pass
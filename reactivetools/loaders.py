@@ -18,6 +18,10 @@ def parse_key(key_str):
     if key_str is None:
         return None
 
+    # binary descriptors store keys as raw bytes
+    if isinstance(key_str, (bytes, bytearray)):
+        return bytes(key_str)
+
     return binascii.unhexlify(key_str)
 
 
@@ -1,22 +1,8 @@
 from .base import Module
-from .sancus import SancusModule
-from .native import NativeModule
-from .sgx import SGXModule
+from ..registry import Registry
 
-module_rules = {
-    "sancus"    : "sancus.yaml",
-    "sgx"       : "sgx.yaml",
-    "native"    : "native.yaml"
-}
-
-module_funcs = {
-    "sancus"    : SancusModule.load,
-    "sgx"       : SGXModule.load,
-    "native"    : NativeModule.load
-}
-
-module_cleanup_coros = [
-    SancusModule.cleanup,
-    SGXModule.cleanup,
-    NativeModule.cleanup
-]
+module_registry = Registry(__name__, "reactivetools.modules", {
+    "sancus"    : (".sancus", "SancusModule", "sancus.yaml"),
+    "sgx"       : (".sgx", "SGXModule", "sgx.yaml"),
+    "native"    : (".native", "NativeModule", "native.yaml")
+})
@@ -1,7 +1,4 @@
 from abc import ABC, abstractmethod
-import os
-import logging
-from .. import glob
 
 class Error(Exception):
     pass
@@ -29,15 +26,6 @@ class Module(ABC):
 
         self.connections = 0
 
-        # create temp dir
-        try:
-            os.mkdir(os.path.join(glob.BUILD_DIR, name))
-        except FileExistsError:
-            pass
-        except:
-            logging.error("Failed to create build dir for {}".format(name))
-            sys.exit(-1)
-            
 
     """
     ### Description ###
@@ -274,9 +262,10 @@ class Module(ABC):
     arg (bytes): argument to pass as a byte array (can be None)
 
     ### Returns ###
+    `bytes`: payload of the response
     """
     async def call(self, entry, arg=None):
-        await self.node.call(self, entry, arg)
+        return await self.node.call(self, entry, arg)
 
 
     """
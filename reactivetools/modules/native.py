@@ -4,9 +4,10 @@ import os
 
 from .base import Module
 
-from ..nodes import NativeNode
+from ..nodes.native import NativeNode
 from .. import tools
 from .. import glob
+from .. import cache
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
@@ -27,6 +28,8 @@ class NativeModule(Module):
 
         self.__generate_fut = tools.init_future(data, key)
         self.__build_fut = tools.init_future(binary)
+        self.__fingerprint_fut = None
+        self.__manifest_fut = None
 
         self.features = [] if features is None else features
         self.id = id if id is not None else node.get_module_id()
@@ -229,6 +232,11 @@ class NativeModule(Module):
 
 
     async def __generate_code(self):
+        manifest = await self.__get_manifest()
+        if manifest is not None:
+            logging.info("Module {} unchanged, skipping code generation".format(self.name))
+            return manifest["data"], parse_key(manifest["key"])
+
         try:
             import rustsgxgen
         except:
@@ -244,23 +252,79 @@ class NativeModule(Module):
         args.spkey = None
         args.print = None
 
-        data, key = rustsgxgen.generate(args)
+        data, key = await tools.run_in_process(rustsgxgen.generate, args)
         logging.info("Generated code for module {}".format(self.name))
 
         return data, key
 
 
     async def __build(self):
-        await self.generate_code()
+        manifest = await self.__get_manifest()
+        if manifest is not None:
+            logging.info("Module {} unchanged, skipping build".format(self.name))
+            return manifest["binary"]
+
+        data, key = await self.generate_code()
 
         release = "--release" if glob.get_build_mode() == glob.BuildMode.RELEASE else ""
         features = "--features " + " ".join(self.features) if self.features else ""
 
         cmd = BUILD_APP.format(release, features, self.output).split()
-        await tools.run_async(*cmd)
+        target_dir = glob.get_cargo_target_dir("host")
 
-        binary = os.path.join(self.output,
-                        "target", glob.get_build_mode().to_str(), self.folder)
+        if target_dir is None:
+            await tools.run_async(*cmd, label=self.name)
+            target_dir = os.path.join(self.output, "target")
+        else:
+            # cargo locks the whole target directory while building: wait for
+            # the other modules here, without holding a job slot
+            async with tools.get_path_lock(target_dir):
+                await tools.run_async(*cmd, "--target-dir", target_dir,
+                                      label=self.name)
+
+        binary = os.path.join(target_dir,
+                        glob.get_build_mode().to_str(), self.folder)
 
         logging.info("Built module {}".format(self.name))
+
+        cache.save_manifest(self.name, await self.__get_fingerprint(),
+                    {"data": data, "key": key.hex(), "binary": binary}, [binary])
+
         return binary
+
+
+    # Manifest of the previous build, if none of its inputs changed since then
+    async def __get_manifest(self):
+        if self.__manifest_fut is None:
+            self.__manifest_fut = asyncio.ensure_future(self.__load_manifest())
+
+        return await self.__manifest_fut
+
+
+    async def __load_manifest(self):
+        fingerprint = await self.__get_fingerprint()
+        return await asyncio.get_event_loop().run_in_executor(None,
+                    cache.load_manifest, self.name, fingerprint)
+
+
+    # Digest of all the inputs of code generation and build
+    async def __get_fingerprint(self):
+        if self.__fingerprint_fut is None:
+            self.__fingerprint_fut = asyncio.ensure_future(self.__fingerprint())
+
+        return await self.__fingerprint_fut
+
+
+    async def __fingerprint(self):
+        folder = await asyncio.get_event_loop().run_in_executor(None,
+                    cache.hash_dir, self.folder)
+
+        return cache.digest(
+            "native",
+            cache.get_version("rust-sgx-gen"),
+            folder,
+            " ".join(self.features),
+            self.id,
+            self.node.deploy_port,
+            glob.get_build_mode().to_str()
+        )
@@ -1,14 +1,21 @@
 import logging
 import asyncio
 import binascii
+import mmap
+import os
+import re
+import shutil
+import time
 from enum import Enum
 from collections import namedtuple
 
 from elftools.elf import elffile
 
 from .base import Module
-from ..nodes import SancusNode
+from ..nodes.sancus import SancusNode
 from .. import tools
+from .. import glob
+from .. import cache
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
@@ -19,7 +26,7 @@ class Error(Exception):
 
 class SancusModule(Module):
     def __init__(self, name, node, priority, deployed, nonce, attested, files,
-            cflags, ldflags, binary, id, symtab, key):
+            cflags, ldflags, binary, id, symtab, key, symbols):
         super().__init__(name, node, priority, deployed, nonce, attested)
 
         self.files = files
@@ -30,6 +37,7 @@ class SancusModule(Module):
         self.__deploy_fut = tools.init_future(id, symtab)
         self.__key_fut = tools.init_future(key)
         self.__attest_fut = tools.init_future(attested if attested else None)
+        self.__symbols_fut = tools.init_future(symbols)
 
 
     @staticmethod
@@ -48,9 +56,10 @@ class SancusModule(Module):
         id = mod_dict.get('id')
         symtab = parse_file_name(mod_dict.get('symtab'))
         key = parse_key(mod_dict.get('key'))
+        symbols = mod_dict.get('symbols')
 
         return SancusModule(name, node, priority, deployed, nonce, attested,
-                files, cflags, ldflags, binary, id, symtab, key)
+                files, cflags, ldflags, binary, id, symtab, key, symbols)
 
 
     def dump(self):
@@ -68,10 +77,23 @@ class SancusModule(Module):
             "binary": dump(self.binary) if self.deployed else None,
             "id": dump(self.id) if self.deployed else None,
             "symtab": dump(self.symtab) if self.deployed else None,
-            "key": dump(self.key) if self.deployed else None
+            "key": dump(self.key) if self.deployed else None,
+            "symbols": self.__dump_symbols() if self.deployed else None
         }
 
 
+    # Symbols are only dumped if they have already been read (or loaded from
+    # the descriptor): the ELF file is not read just to write the descriptor
+    def __dump_symbols(self):
+        fut = self.__symbols_fut
+
+        if fut is None or not fut.done() or fut.cancelled() or \
+                fut.exception() is not None:
+            return None
+
+        return dump(fut.result())
+
+
     # --- Properties --- #
 
     @property
@@ -88,6 +110,13 @@ class SancusModule(Module):
         _, symtab = await self.deploy()
         return symtab
 
+    @property
+    async def symbols(self):
+        if self.__symbols_fut is None:
+            self.__symbols_fut = asyncio.ensure_future(self.__read_symbols())
+
+        return await self.__symbols_fut
+
     @property
     async def key(self):
         if self.__key_fut is None:
@@ -186,51 +215,142 @@ class SancusModule(Module):
                      self.name, ', '.join(map(str, self.files)))
 
         config = self._get_build_config(tools.get_verbosity())
-        objects = {str(p): tools.create_tmp(suffix='.o', dir=self.name) for p in self.files}
 
         cflags = config.cflags + self.cflags
-        build_obj = lambda c, o: tools.run_async(config.cc, *cflags,
-                                                 '-c', '-o', o, c)
-        build_futs = [build_obj(c, o) for c, o in objects.items()]
-        await asyncio.gather(*build_futs)
 
-        binary = tools.create_tmp(suffix='.elf', dir=self.name)
+        # objects built in a previous run are reused if their inputs did not
+        # change, i.e., same compiler and flags, same sources and headers
+        fingerprint = cache.digest(await _get_toolchain_id(config.cc), *cflags)
+        manifest = cache.load_manifest(self.name, fingerprint) or {}
+        prev_objects = manifest.get("objects", {})
+
+        build_futs = [self.__build_object(config.cc, cflags, str(c),
+                            prev_objects.get(str(c))) for c in self.files]
+        results = await asyncio.gather(*build_futs)
+
+        objects = {source: entry for source, entry in zip(map(str, self.files), results)}
+        cache.save_manifest(self.name, fingerprint, {"objects": objects})
+
         ldflags = config.ldflags + self.ldflags
 
         # setting connections (if not specified in JSON file)
         if not any("--num-connections" in flag for flag in ldflags):
             ldflags.append("--num-connections {}".format(self.connections))
 
-        await tools.run_async(config.ld, *ldflags,
-                              '-o', binary, *objects.values())
-        return binary
+        # binaries are cached by the content of their objects, so that a
+        # binary recorded in a deployment descriptor is never overwritten
+        key = cache.digest(await _get_toolchain_id(config.ld), *ldflags,
+                    *[entry["hash"] for entry in results])
+        cached = cache.lookup(key, '.elf')
+        if cached is not None:
+            logging.info('Reusing cached binary of module %s', self.name)
+            return cached
+
+        binary = tools.create_tmp(suffix='.elf', dir=self.name)
+        await tools.run_async(config.ld, *ldflags, '-o', binary,
+                              *[entry["object"] for entry in results],
+                              label=self.name)
+        return cache.store(key, binary, '.elf')
+
+
+    # Compile `source` to a stable object path, unless the object built
+    # previously (`prev`, from the manifest) is still up to date. Returns the
+    # manifest entry of the object
+    async def __build_object(self, cc, cflags, source, prev):
+        if prev is not None and os.path.exists(prev["object"]) \
+                and not _deps_changed(prev["deps"]):
+            logging.debug('Object of %s is up to date', source)
+            return prev
+
+        base = os.path.splitext(os.path.basename(source))[0]
+        prefix = os.path.join(glob.BUILD_DIR, self.name, "objects", "{}-{}".format(
+                    base, cache.digest(os.path.abspath(source))[:8]))
+        obj = prefix + ".o"
+        dep_file = prefix + ".d"
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+
+        # remove stale dependencies, in case the compiler does not emit them
+        if os.path.exists(dep_file):
+            os.remove(dep_file)
+
+        await tools.run_async(cc, *cflags, '-MMD', '-MF', dep_file,
+                              '-c', '-o', obj, source, label=self.name)
+
+        deps = _parse_dep_file(dep_file)
+        if deps is None:
+            include_dirs = [f[2:] for f in cflags if f.startswith('-I') and len(f) > 2]
+            deps = [source] + _find_headers(source, include_dirs)
 
+        return {
+            "object": obj,
+            "hash": cache.hash_file(obj),
+            "deps": {d: _file_state(d) for d in deps}
+        }
 
 
     async def _calculate_key(self):
+        loop = asyncio.get_event_loop()
+        binary_hash = await loop.run_in_executor(None, cache.hash_file,
+                                await self.binary)
+        symtab_hash = await loop.run_in_executor(None, cache.hash_file,
+                                await self.symtab)
+
+        # the key only depends on the linked binary, i.e., on the binary and
+        # the symbol table, on the name of the module and on the vendor key
+        key_id = cache.digest(binary_hash, symtab_hash, self.name,
+                                self.node.vendor_key)
+
+        cached = cache.lookup(key_id, '.key')
+        if cached is not None:
+            with open(cached, 'rb') as f:
+                key = f.read()
+
+            logging.info('Reusing cached key of module %s', self.name)
+            return key
+
+        # only needed to compute the key
         try:
             import sancus.crypto
         except:
             raise Error("Sancus python libraries not found in PYTHONPATH")
 
-        linked_binary = await self.__link()
+        start = time.monotonic()
+        linked_binary = await self.__link(binary_hash, symtab_hash)
+        link_time = time.monotonic() - start
 
-        with open(linked_binary, 'rb') as f:
-            key = sancus.crypto.get_sm_key(f, self.name, self.node.vendor_key)
-            logging.info('Module key for %s: %s',
-                         self.name, binascii.hexlify(key).decode('ascii'))
-            return key
+        start = time.monotonic()
+        key = await loop.run_in_executor(None, _get_sm_key, linked_binary,
+                                self.name, self.node.vendor_key)
+        key_time = time.monotonic() - start
+
+        tmp = tools.create_tmp(suffix='.key', dir=self.name)
+        with open(tmp, 'wb') as f:
+            f.write(key)
+        cache.store(key_id, tmp, '.key')
+
+        logging.info('Module key for %s: %s (link: %.2fs, hash: %.2fs)',
+                     self.name, binascii.hexlify(key).decode('ascii'),
+                     link_time, key_time)
+        return key
 
 
-    async def __link(self):
+    async def __link(self, binary_hash, symtab_hash):
+        key = cache.digest(await _get_toolchain_id('msp430-ld'),
+                            binary_hash, symtab_hash)
+
+        cached = cache.lookup(key, '.elf')
+        if cached is not None:
+            return cached
+
         linked_binary = tools.create_tmp(suffix='.elf', dir=self.name)
 
         # NOTE: we use '--noinhibit-exec' flag because the linker complains
         #       if the addresses of .bss section are not aligned to 2 bytes
         #       using this flag instead, the output file is still generated
         await tools.run_async('msp430-ld', '-T', await self.symtab,
-                      '-o', linked_binary, '--noinhibit-exec', await self.binary)
-        return linked_binary
+                      '-o', linked_binary, '--noinhibit-exec', await self.binary,
+                      label=self.name)
+        return cache.store(key, linked_binary, '.elf')
 
 
     async def _get_io_id(self, io_name):
@@ -256,17 +376,147 @@ class SancusModule(Module):
 
 
     async def __get_symbol(self, name):
-        if not await self.binary:
-            raise Error("ELF file not present for {}, cannot extract symbol ID of {}".format(self.name, name))
+        symbols = await self.symbols
+        return symbols.get(name)
+
+
+    async def __read_symbols(self):
+        binary = await self.binary
+        if not binary:
+            raise Error("ELF file not present for {}, cannot extract symbol IDs".format(self.name))
 
-        with open(await self.binary, 'rb') as f:
-            elf = elffile.ELFFile(f)
-            for section in elf.iter_sections():
-                if isinstance(section, elffile.SymbolTableSection):
-                    for symbol in section.iter_symbols():
-                        sym_section = symbol['st_shndx']
-                        if symbol.name == name and sym_section != 'SHN_UNDEF':
-                            return symbol['st_value']
+        return await asyncio.get_event_loop().run_in_executor(None,
+                        _read_symbols, binary)
 
 
 _BuildConfig = namedtuple('_BuildConfig', ['cc', 'cflags', 'ld', 'ldflags'])
+
+
+def _get_sm_key(linked_binary, name, vendor_key):
+    import sancus.crypto
+
+    with open(linked_binary, 'rb') as f:
+        return sancus.crypto.get_sm_key(f, name, vendor_key)
+
+
+_SYMBOL_RE = re.compile(r'^__sm_.*_idx$')
+
+# Defined __sm_*_idx symbols of an ELF file (IDs of entry points and I/O),
+# read through mmap in a single pass
+def _read_symbols(binary):
+    symbols = {}
+
+    with open(binary, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        elf = elffile.ELFFile(m)
+
+        for section in elf.iter_sections():
+            if not isinstance(section, elffile.SymbolTableSection):
+                continue
+
+            for symbol in section.iter_symbols():
+                if symbol['st_shndx'] != 'SHN_UNDEF' and \
+                        _SYMBOL_RE.match(symbol.name):
+                    symbols[symbol.name] = symbol['st_value']
+
+    return symbols
+
+
+_INCLUDE_RE = re.compile(rb'^\s*#\s*include\s*"([^"]+)"', re.MULTILINE)
+
+# Local headers included by `source`, directly or transitively.
+# System headers (#include <...>) are part of the toolchain
+def _find_headers(source, include_dirs):
+    headers = set()
+    to_scan = [source]
+
+    while to_scan:
+        file = to_scan.pop()
+
+        with open(file, 'rb') as f:
+            includes = _INCLUDE_RE.findall(f.read())
+
+        for inc in includes:
+            inc = inc.decode(errors='replace')
+            for d in [os.path.dirname(file)] + include_dirs:
+                path = os.path.abspath(os.path.join(d, inc))
+                if os.path.isfile(path):
+                    if path not in headers:
+                        headers.add(path)
+                        to_scan.append(path)
+                    break
+
+    return sorted(headers)
+
+
+# Prerequisites listed in a make-style dependency file (as generated by -MMD),
+# or None if the file does not exist
+def _parse_dep_file(dep_file):
+    try:
+        with open(dep_file, 'r') as f:
+            contents = f.read()
+    except FileNotFoundError:
+        return None
+
+    # join continuation lines, and split on spaces that are not escaped
+    contents = contents.replace('\\\n', ' ')
+    deps = []
+
+    for line in contents.splitlines():
+        _, sep, prereqs = line.partition(':')
+        if not sep:
+            continue
+
+        for dep in re.split(r'(?<!\\)\s+', prereqs.strip()):
+            dep = dep.replace('\\ ', ' ')
+            if dep and dep not in deps:
+                deps.append(dep)
+
+    return deps
+
+
+# State of a dependency: modification time, size and content hash. The hash is
+# computed again only if the modification time or size changed
+def _file_state(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size, cache.hash_file(path)]
+
+
+def _deps_changed(deps):
+    for path, (mtime, size, hash) in deps.items():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return True
+
+        if (st.st_mtime_ns, st.st_size) == (mtime, size):
+            continue
+
+        if st.st_size != size or cache.hash_file(path) != hash:
+            return True
+
+    return False
+
+
+_toolchain_ids = {}
+
+# Identifies the version of a tool of the toolchain, to invalidate the cache
+# when the toolchain is updated
+async def _get_toolchain_id(tool):
+    if tool not in _toolchain_ids:
+        _toolchain_ids[tool] = asyncio.ensure_future(_toolchain_id(tool))
+
+    return await _toolchain_ids[tool]
+
+
+async def _toolchain_id(tool):
+    path = shutil.which(tool)
+    if path is None:
+        raise Error("{} not found".format(tool))
+
+    try:
+        version, _ = await tools.run_async_output(tool, '--version')
+    except tools.ProcessRunError:
+        version = b''
+
+    return cache.digest(cache.hash_file(path), version)
@@ -1,13 +1,14 @@
 import asyncio
 import logging
 import os
-import aiofile
+import time
 
 from .base import Module
 
-from ..nodes import SGXNode
+from ..nodes.sgx import SGXNode
 from .. import tools
 from .. import glob
+from .. import cache
 from ..crypto import Encryption
 from ..dumpers import *
 from ..loaders import *
@@ -18,7 +19,11 @@ ATTESTER = "sgx-attester"
 # SGX build/sign
 SGX_TARGET = "x86_64-fortanix-unknown-sgx"
 BUILD_APP = "cargo build {{}} {{}} --target={} --manifest-path={{}}/Cargo.toml".format( SGX_TARGET)
-CONVERT_SGX = "ftxsgx-elf2sgxs {} --heap-size 0x20000 --stack-size 0x20000 --threads 4 {}"
+HEAP_SIZE = 0x20000
+STACK_SIZE = 0x20000
+THREADS = 4
+CONVERT_SGX = "ftxsgx-elf2sgxs {{}} --heap-size {:#x} --stack-size {:#x} --threads {} {{}}".format(
+                HEAP_SIZE, STACK_SIZE, THREADS)
 SIGN_SGX = "sgxs-sign --key {} {} {} {} --xfrm 7/0 --isvprodid 0 --isvsvn 0"
 
 
@@ -41,7 +46,9 @@ class SGXModule(Module):
         self.__build_fut = tools.init_future(binary)
         self.__convert_sign_fut = tools.init_future(sgxs, signature)
         self.__attest_fut = tools.init_future(key)
-        self.__sp_keys_fut = asyncio.ensure_future(self.__generate_sp_keys())
+        self.__sp_keys_fut = None
+        self.__fingerprint_fut = None
+        self.__manifest_fut = None
 
         self.key = key
         self.vendor_key = vendor_key
@@ -269,23 +276,30 @@ class SGXModule(Module):
     # --- Others --- #
 
     async def get_ra_sp_pub_key(self):
-        pub, _, _ = await self.__sp_keys_fut
+        pub, _, _ = await self.__sp_keys()
 
         return pub
 
 
     async def get_ra_sp_priv_key(self):
-        _, priv, _ = await self.__sp_keys_fut
+        _, priv, _ = await self.__sp_keys()
 
         return priv
 
 
     async def get_ias_root_certificate(self):
-        _, _, cert = await self.__sp_keys_fut
+        _, _, cert = await self.__sp_keys()
 
         return cert
 
 
+    async def __sp_keys(self):
+        if self.__sp_keys_fut is None:
+            self.__sp_keys_fut = asyncio.ensure_future(self.__generate_sp_keys())
+
+        return await self.__sp_keys_fut
+
+
     async def generate_code(self):
         if self.__generate_fut is None:
             self.__generate_fut = asyncio.ensure_future(self.__generate_code())
@@ -294,6 +308,11 @@ class SGXModule(Module):
 
 
     async def __generate_code(self):
+        manifest = await self.__get_manifest()
+        if manifest is not None:
+            logging.info("Module {} unchanged, skipping code generation".format(self.name))
+            return manifest["data"]
+
         try:
             import rustsgxgen
         except:
@@ -309,43 +328,131 @@ class SGXModule(Module):
         args.spkey = await self.get_ra_sp_pub_key()
         args.print = None
 
-        data, _ = rustsgxgen.generate(args)
+        data, _ = await tools.run_in_process(rustsgxgen.generate, args)
         logging.info("Generated code for module {}".format(self.name))
 
         return data
 
 
     async def __build(self):
-        await self.generate_code()
+        manifest = await self.__get_manifest()
+        if manifest is not None:
+            logging.info("Module {} unchanged, skipping build".format(self.name))
+            return manifest["binary"]
+
+        data = await self.generate_code()
 
         release = "--release" if glob.get_build_mode() == glob.BuildMode.RELEASE else ""
         features = "--features " + " ".join(self.features) if self.features else ""
 
         cmd = BUILD_APP.format(release, features, self.output).split()
-        await tools.run_async(*cmd)
-
-        binary = os.path.join(self.output, "target", SGX_TARGET,
+        target_dir = glob.get_cargo_target_dir(SGX_TARGET)
+
+        if target_dir is None:
+            await tools.run_async(*cmd, label=self.name)
+            target_dir = os.path.join(self.output, "target")
+        else:
+            # cargo locks the whole target directory while building: wait for
+            # the other modules here, without holding a job slot
+            async with tools.get_path_lock(target_dir):
+                await tools.run_async(*cmd, "--target-dir", target_dir,
+                                      label=self.name)
+
+        binary = os.path.join(target_dir, SGX_TARGET,
                         glob.get_build_mode().to_str(), self.folder)
 
         logging.info("Built module {}".format(self.name))
 
+        cache.save_manifest(self.name, await self.__get_fingerprint(),
+                    {"data": data, "binary": binary}, [binary])
+
         return binary
 
 
+    # Manifest of the previous build, if none of its inputs changed since then
+    async def __get_manifest(self):
+        if self.__manifest_fut is None:
+            self.__manifest_fut = asyncio.ensure_future(self.__load_manifest())
+
+        return await self.__manifest_fut
+
+
+    async def __load_manifest(self):
+        fingerprint = await self.__get_fingerprint()
+        return await asyncio.get_event_loop().run_in_executor(None,
+                    cache.load_manifest, self.name, fingerprint)
+
+
+    # Digest of all the inputs of code generation and build
+    async def __get_fingerprint(self):
+        if self.__fingerprint_fut is None:
+            self.__fingerprint_fut = asyncio.ensure_future(self.__fingerprint())
+
+        return await self.__fingerprint_fut
+
+
+    async def __fingerprint(self):
+        loop = asyncio.get_event_loop()
+        folder = await loop.run_in_executor(None, cache.hash_dir, self.folder)
+        sp_key = await loop.run_in_executor(None, cache.hash_file,
+                    await self.get_ra_sp_pub_key())
+
+        return cache.digest(
+            "sgx",
+            cache.get_version("rust-sgx-gen"),
+            folder,
+            " ".join(self.features),
+            self.id,
+            self.node.deploy_port,
+            sp_key,
+            glob.get_build_mode().to_str()
+        )
+
+
     async def __convert_sign(self):
         binary = await self.binary
         debug = "--debug" if glob.get_build_mode() == glob.BuildMode.DEBUG else ""
 
-        sgxs = "{}.sgxs".format(binary)
-        sig = "{}.sig".format(binary)
+        loop = asyncio.get_event_loop()
+        binary_hash = await loop.run_in_executor(None, cache.hash_file, binary)
+        vendor_key_hash = await loop.run_in_executor(None, cache.hash_file,
+                                self.vendor_key)
+
+        # the SGXS only depends on the ELF and the enclave settings, so that
+        # changing the vendor key only requires signing again
+        sgxs_key = cache.digest(binary_hash, HEAP_SIZE, STACK_SIZE, THREADS, debug)
+        sig_key = cache.digest(sgxs_key, vendor_key_hash, debug)
+
+        # modules with the same ELF (and key) wait for each other's outputs
+        async with tools.get_path_lock(cache.get_path(sgxs_key, '.sgxs')):
+            start = time.monotonic()
+            sgxs = cache.lookup(sgxs_key, '.sgxs')
+
+            if sgxs is None:
+                cmd_convert = CONVERT_SGX.format(binary, debug).split()
+                await tools.run_async(*cmd_convert, label=self.name)
+                sgxs = cache.store(sgxs_key, "{}.sgxs".format(binary), '.sgxs')
+
+            convert_time = time.monotonic() - start
+
+        async with tools.get_path_lock(cache.get_path(sig_key, '.sig')):
+            start = time.monotonic()
+            sig = cache.lookup(sig_key, '.sig')
+
+            if sig is None:
+                tmp = tools.create_tmp(suffix='.sig', dir=self.name)
 
-        cmd_convert = CONVERT_SGX.format(binary, debug).split()
-        cmd_sign = SIGN_SGX.format(self.vendor_key, sgxs, sig, debug).split()
+                try:
+                    cmd_sign = SIGN_SGX.format(self.vendor_key, sgxs, tmp, debug).split()
+                    await tools.run_async(*cmd_sign, label=self.name)
+                    sig = cache.store(sig_key, tmp, '.sig')
+                finally:
+                    os.remove(tmp)
 
-        await tools.run_async(*cmd_convert)
-        await tools.run_async(*cmd_sign)
+            sign_time = time.monotonic() - start
 
-        logging.info("Converted & signed module {}".format(self.name))
+        logging.info("Converted & signed module {} (convert: {:.2f}s, sign: {:.2f}s)"
+                        .format(self.name, convert_time, sign_time))
 
         return sgxs, sig
 
@@ -1,22 +1,8 @@
 from .base import Node
-from .sancus import SancusNode
-from .native import NativeNode
-from .sgx import SGXNode
+from ..registry import Registry
 
-node_rules = {
-    "sancus"    : "sancus.yaml",
-    "sgx"       : "sgx.yaml",
-    "native"    : "native.yaml"
-}
-
-node_funcs = {
-    "sancus"    : SancusNode.load,
-    "sgx"       : SGXNode.load,
-    "native"    : NativeNode.load
-}
-
-node_cleanup_coros = [
-    SancusNode.cleanup,
-    SGXNode.cleanup,
-    NativeNode.cleanup
-]
+node_registry = Registry(__name__, "reactivetools.nodes", {
+    "sancus"    : (".sancus", "SancusNode", "sancus.yaml"),
+    "sgx"       : (".sgx", "SGXNode", "sgx.yaml"),
+    "native"    : (".native", "NativeNode", "native.yaml")
+})
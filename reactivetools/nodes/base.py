@@ -1,19 +1,23 @@
 import asyncio
 import logging
 import binascii
+import time
+import random
 
 from abc import ABC, abstractmethod
 from enum import IntEnum
 
 from reactivenet import *
 
+from . import pool
 from .. import tools
+from .. import glob
 
 class Error(Exception):
     pass
 
 class Node(ABC):
-    def __init__(self, name, ip_address, reactive_port, deploy_port, need_lock=False):
+    def __init__(self, name, ip_address, reactive_port, deploy_port, max_inflight=None):
         """
         Generic attributes common to all Node subclasses
 
@@ -22,8 +26,9 @@ class Node(ABC):
         ip_address (ip_address): IP of the node
         reactive_port (int): port where the event manager listens for events
         deploy_port (int): port where the event manager listens for new modules
-        need_lock (bool): a bool indicating if the events need to be
-                    delivered one at a time due to some limitations on the EM
+        max_inflight (int): maximum number of commands (or batches of
+                    commands) sent to the EM at the same time, due to some
+                    limitations on the EM. None means no limit
         """
 
         self.name = name
@@ -31,10 +36,14 @@ class Node(ABC):
         self.reactive_port = reactive_port
         self.deploy_port = deploy_port
 
-        if need_lock:
-            self.__lock = asyncio.Lock()
-        else:
-            self.__lock = None
+        self.max_inflight = max_inflight
+        self.__window = InflightWindow(max_inflight)
+
+        self.__deploy_budget = None
+
+        # commands waiting to be sent in a batch, and the task sending them
+        self.__queue = []
+        self.__flusher = None
 
 
 
@@ -171,7 +180,8 @@ class Node(ABC):
 
         await self._send_reactive_command(
                 command,
-                log='Connecting id {} to {}'.format(conn_id, to_module.name))
+                log='Connecting id {} to {}'.format(conn_id, to_module.name),
+                idempotent=True)
 
 
 
@@ -186,6 +196,7 @@ class Node(ABC):
     arg (bytes): argument to pass as a byte array (can be None)
 
     ### Returns ###
+    `bytes`: payload of the response (None if the call failed)
     """
     async def call(self, module, entry, arg=None):
         assert module.node is self
@@ -210,9 +221,11 @@ class Node(ABC):
 
         if not response.ok():
             logging.error("Received error code {}".format(str(response.code)))
-        else:
-            logging.info("Response: \"{}\"".format(
-                binascii.hexlify(response.message.payload).decode('ascii')))
+            return None
+
+        logging.info("Response: \"{}\"".format(
+            binascii.hexlify(response.message.payload).decode('ascii')))
+        return response.message.payload
 
 
     """
@@ -265,6 +278,7 @@ class Node(ABC):
     arg (bytes): argument to pass as a byte array (can be None)
 
     ### Returns ###
+    `bytes`: decrypted payload of the response (None if the request failed)
     """
     async def request(self, connection, arg=None):
         assert connection.to_module.node is self
@@ -296,7 +310,7 @@ class Node(ABC):
 
         if not response.ok():
             logging.error("Received error code {}".format(str(response.code)))
-            return
+            return None
 
         resp_encrypted = response.message.payload
         plaintext = await connection.encryption.decrypt(connection.key,
@@ -304,6 +318,7 @@ class Node(ABC):
 
         logging.info("Response: \"{}\"".format(
             binascii.hexlify(plaintext).decode('ascii')))
+        return plaintext
 
 
 
@@ -344,20 +359,184 @@ class Node(ABC):
     ### Description ###
     Coroutine. Wrapper to __send_reactive_command (see below)
 
+    If the node does not answer within glob.get_command_timeout() seconds, or
+    the connection fails, idempotent commands (i.e., that can be processed
+    twice by the EM without side effects, e.g., Connect) are sent again up to
+    glob.get_command_retries() times, with exponential backoff. Commands
+    answered with an error code are never sent again
+
     ### Parameters ###
     self: Node object
     command (ReactiveCommand): command to send to the node
     log (str): optional text message printed to stdout (can be None)
+    idempotent (bool): True if the command can be safely sent again
 
     ### Returns ###
     """
-    async def _send_reactive_command(self, command, log=None):
-        if self.__lock is not None:
-            async with self.__lock:
-                return await self.__send_reactive_command(command, log)
-        else:
-            return await self.__send_reactive_command(command, log)
+    async def _send_reactive_command(self, command, log=None, idempotent=False):
+        retries = glob.get_command_retries() if idempotent else 0
+        attempt = 0
+
+        while True:
+            try:
+                return await self.__send_once(command,
+                                              log if attempt == 0 else None,
+                                              idempotent)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    reason = "no response after {}s".format(
+                                glob.get_command_timeout())
+                else:
+                    reason = str(e) or type(e).__name__
+
+                if attempt >= retries:
+                    raise Error('Reactive command {} to {} failed: {}'.format(
+                                    str(command.code), self.name, reason)) from e
+
+                delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt)
+                delay *= random.uniform(0.5, 1)
+                attempt += 1
+
+                logging.warning("Reactive command {} to {} failed ({}), "
+                                "retrying in {:.1f}s ({}/{})".format(
+                                str(command.code), self.name, reason, delay,
+                                attempt, retries))
+                await asyncio.sleep(delay)
+
+
+    async def __send_once(self, command, log, idempotent):
+        if _can_batch(command):
+            return await self.__send_batched(command, log, idempotent)
+
+        async with self.__window:
+            return await self.__send_reactive_command(command, log, idempotent)
+
+
+    """
+    ### Description ###
+    Coroutine. Queues a command in the next batch of the node, and waits for
+    its response
+
+    A batch takes one slot of the in-flight window, and contains all the
+    commands queued when the slot is acquired (up to MAX_BATCH), pipelined on
+    a single connection for each event manager port (see pool.send_many)
+    instead of one round trip each. Hence, a command alone is sent right away,
+    while commands queued while the window is full are sent together as soon
+    as a slot is free. Each command has its own timeout.
+
+    ### Parameters ###
+    self: Node object
+    command (ReactiveCommand): command to send to the node
+    log (str): optional text message printed to stdout (can be None)
+    idempotent (bool): True if the command can be safely sent again
+
+    ### Returns ###
+    `ResultMessage`: response of the command
+    """
+    async def __send_batched(self, command, log, idempotent):
+        if log is not None:
+            logging.info(log)
+
+        fut = asyncio.get_event_loop().create_future()
+        self.__queue.append((command, idempotent, fut))
+
+        if self.__flusher is None:
+            self.__flusher = asyncio.ensure_future(self.__flush_queue())
+
+        response = await fut
+        if not response.ok():
+            raise Error('Reactive command {} failed with code {}'
+                            .format(str(command.code), str(response.code)))
+        return response
+
+
+    async def __flush_queue(self):
+        try:
+            while self.__queue:
+                taken = asyncio.Event()
+                asyncio.ensure_future(self.__send_next_batch(taken))
+
+                # the next batch starts with the commands queued meanwhile
+                await taken.wait()
+        finally:
+            self.__flusher = None
+
+
+    async def __send_next_batch(self, taken):
+        try:
+            async with self.__window:
+                batch = [c for c in self.__queue[:MAX_BATCH] if not c[2].done()]
+                del self.__queue[:MAX_BATCH]
+                taken.set()
+
+                by_dest = {}
+                for command, idempotent, fut in batch:
+                    by_dest.setdefault((str(command.ip), command.port), []).append(
+                                        (command, idempotent, fut))
+
+                await asyncio.gather(*map(_send_batch, by_dest.values()))
+        finally:
+            taken.set()
+
+
+    """
+    ### Description ###
+    Coroutine. Wrapper to _send_reactive_command for the commands that deploy
+    a module (e.g., a StreamCommand, see stream.py)
+
+    The command is sent only when its size fits in the bytes that can be in
+    flight to this node and to all nodes (see glob.set_deploy_budget), so that
+    deploying many modules at once does not exhaust the memory of the
+    deployer or of the nodes. The size is taken from `command.size`
+
+    ### Parameters ###
+    self: Node object
+    command (ReactiveCommand): command to send to the node
+    log (str): optional text message printed to stdout (can be None)
+
+    ### Returns ###
+    """
+    async def _send_deploy_command(self, command, log=None):
+        budgets = [self.__get_deploy_budget(), _get_deploy_budget()]
+        budgets = [b for b in budgets if b is not None]
+        acquired = []
 
+        try:
+            # always the node budget first, to avoid holding the global budget
+            # while waiting for a busy node
+            for budget in budgets:
+                acquired.append((budget, await budget.acquire(command.size)))
+
+            return await self._send_reactive_command(command, log)
+        finally:
+            for budget, size in acquired:
+                budget.release(size)
+
+
+    def __get_deploy_budget(self):
+        capacity = glob.get_node_deploy_budget()
+
+        if capacity is None:
+            return None
+
+        if self.__deploy_budget is None or self.__deploy_budget.capacity != capacity:
+            self.__deploy_budget = tools.ByteBudget(capacity)
+
+        return self.__deploy_budget
+
+
+    """
+    ### Description ###
+    Logs the statistics of the in-flight window of the node: commands sent,
+    maximum number of commands waiting for a slot and time spent waiting
+
+    ### Parameters ###
+    self: Node object
+
+    ### Returns ###
+    """
+    def log_stats(self):
+        self.__window.log_stats(self.name)
 
 
     """
@@ -369,21 +548,139 @@ class Node(ABC):
     ### Parameters ###
     command (ReactiveCommand): command to send to the node
     log (str): optional text message printed to stdout (can be None)
+    idempotent (bool): True if the command can be safely sent again
 
     ### Returns ###
     """
     @staticmethod
-    async def __send_reactive_command(command, log):
+    async def __send_reactive_command(command, log, idempotent=False):
         if log is not None:
             logging.info(log)
 
+        # connections to the event managers are reused, see pool.py
+        send = asyncio.wait_for(pool.send(command, idempotent),
+                                glob.get_command_timeout())
+
         if command.has_response():
-            response =  await command.send_wait()
+            response =  await send
             if not response.ok():
                 raise Error('Reactive command {} failed with code {}'
                                 .format(str(command.code), str(response.code)))
             return response
 
         else:
-            await command.send()
+            await send
             return None
+
+
+# maximum number of commands in a batch
+MAX_BATCH = 64
+
+# seconds before the first retry of a command, doubled at each retry
+RETRY_DELAY = 0.5
+RETRY_MAX_DELAY = 8
+
+
+# Only commands with a response that are packed in memory are batched. Large
+# commands (e.g., StreamCommand) are sent on their own connection
+def _can_batch(command):
+    return command.has_response() and not hasattr(command, "write")
+
+
+async def _send_batch(batch):
+    commands = [command for command, _, _ in batch]
+    idempotent = [idempotent for _, idempotent, _ in batch]
+
+    try:
+        results = await pool.send_many(commands, idempotent,
+                                       glob.get_command_timeout())
+    except Exception as e:
+        results = [e] * len(batch)
+
+    if len(batch) > 1:
+        logging.debug("Sent {} commands pipelined to {}:{}".format(
+                        len(batch), commands[0].ip, commands[0].port))
+
+    for (_, _, fut), result in zip(batch, results):
+        if fut.done():
+            continue
+
+        if isinstance(result, Exception):
+            fut.set_exception(result)
+        else:
+            fut.set_result(result)
+
+
+_deploy_budget = None
+
+def _get_deploy_budget():
+    global _deploy_budget
+    capacity = glob.get_deploy_budget()
+
+    if capacity is None:
+        return None
+
+    if _deploy_budget is None or _deploy_budget.capacity != capacity:
+        _deploy_budget = tools.ByteBudget(capacity)
+
+    return _deploy_budget
+
+
+class InflightWindow():
+    """
+    Async context manager that limits the commands sent to a node at the same
+    time to `size` (no limit if None), keeping statistics on the commands that
+    had to wait for a slot
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.__sem = asyncio.Semaphore(size) if size is not None else None
+        self.__waiting = 0
+
+        self.commands = 0
+        self.max_queue = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+    async def __aenter__(self):
+        self.commands += 1
+
+        if self.__sem is None:
+            return self
+
+        start = time.monotonic()
+
+        if not self.__sem.locked():
+            await self.__sem.acquire()
+        else:
+            self.__waiting += 1
+            self.max_queue = max(self.max_queue, self.__waiting)
+
+            try:
+                await self.__sem.acquire()
+            finally:
+                self.__waiting -= 1
+
+        wait = time.monotonic() - start
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.__sem is not None:
+            self.__sem.release()
+
+
+    def log_stats(self, name):
+        if self.commands == 0:
+            return
+
+        logging.info("{}: {} commands, max in flight {}, max queue depth {}, "
+                     "waited {:.2f}s (max {:.2f}s)".format(
+                        name, self.commands,
+                        self.size if self.size is not None else "unlimited",
+                        self.max_queue, self.total_wait, self.max_wait))
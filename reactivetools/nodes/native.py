@@ -1,10 +1,10 @@
 import asyncio
-import aiofile
 import ipaddress
 
-from reactivenet import CommandMessageLoad
+from reactivenet import ReactiveCommand
 
 from .sgx import SGXBase
+from .stream import StreamCommand, file_size
 from .. import tools
 from ..dumpers import *
 from ..loaders import *
@@ -19,9 +19,10 @@ class NativeNode(SGXBase):
         reactive_port = node_dict['reactive_port']
         deploy_port = node_dict.get('deploy_port') or reactive_port
         module_id = node_dict.get('module_id')
+        max_inflight = node_dict.get('max_inflight')
 
         return NativeNode(name, ip_address, reactive_port, deploy_port,
-                    module_id)
+                    module_id, max_inflight)
 
 
     def dump(self):
@@ -31,7 +32,8 @@ class NativeNode(SGXBase):
             "ip_address": str(self.ip_address),
             "reactive_port": self.reactive_port,
             "deploy_port": self.deploy_port,
-            "module_id": self._moduleid
+            "module_id": self._moduleid,
+            "max_inflight": self.max_inflight
         }
 
 
@@ -39,17 +41,20 @@ class NativeNode(SGXBase):
         if module.deployed:
             return
 
-        async with aiofile.AIOFile(await module.binary, "rb") as f:
-            binary = await f.read()
+        binary = await module.binary
 
-        payload =   tools.pack_int32(len(binary))             + \
-                    binary
+        # the binary is streamed from the file, see stream.py
+        parts = [
+            tools.pack_int8(ReactiveCommand.Load),
+            tools.pack_int32(file_size(binary)),
+            binary
+        ]
 
-        command = CommandMessageLoad(payload,
+        command = StreamCommand(ReactiveCommand.Load, parts,
                                 self.ip_address,
                                 self.deploy_port)
 
-        await self._send_reactive_command(
+        await self._send_deploy_command(
             command,
             log='Deploying {} on {}'.format(module.name, self.name)
             )
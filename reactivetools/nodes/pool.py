@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+
+from reactivenet import ResultMessage
+
+# Pool of TCP connections to the event managers, reused across commands
+# instead of opening a new connection for each of them.
+#
+# Event managers that close the connection after each message are detected
+# the first time a reused connection turns out to be closed: connections to
+# that event manager are not kept alive anymore, and the command is sent again
+# on a new connection if the event manager cannot have processed it. Since a
+# closed connection is usually only noticed when reading the response, commands
+# that must not be processed twice are sent on a reused connection only to
+# event managers known to keep connections alive.
+
+# seconds after which an idle connection is closed instead of being reused
+IDLE_TIMEOUT = 30
+
+# maximum number of idle connections kept for each event manager
+MAX_IDLE = 16
+
+
+class _Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+
+
+    def is_usable(self):
+        return not self.reader.at_eof() and \
+                not self.writer.transport.is_closing() and \
+                time.monotonic() - self.last_used < IDLE_TIMEOUT
+
+
+    def close(self):
+        self.writer.close()
+
+
+# (ip, port) -> list of idle connections
+_idle = {}
+
+# (ip, port) of the event managers that do not support keep-alive
+_no_keepalive = set()
+
+# (ip, port) of the event managers that answered on a reused connection
+_keepalive = set()
+
+
+async def _get_connection(dest, reuse=True):
+    idle = _idle.get(dest, []) if reuse else []
+
+    while idle:
+        conn = idle.pop()
+        if conn.is_usable():
+            return conn, True
+
+        conn.close()
+
+    reader, writer = await asyncio.open_connection(*dest)
+    return _Connection(reader, writer), False
+
+
+def _put_connection(dest, conn):
+    idle = _idle.setdefault(dest, [])
+
+    if dest in _no_keepalive or len(idle) >= MAX_IDLE:
+        conn.close()
+        return
+
+    conn.last_used = time.monotonic()
+    idle.append(conn)
+
+
+async def _write(conn, command):
+    # StreamCommand (see stream.py) writes itself, reactivenet commands are
+    # packed in memory
+    if hasattr(command, "write"):
+        await command.write(conn.writer)
+    else:
+        conn.writer.write(command.pack())
+        await conn.writer.drain()
+
+
+# Send a command to its event manager (command.ip, command.port) through a
+# pooled connection. Returns the ResultMessage, or None if the command has no
+# response. If `idempotent` is True, the command can be processed twice by the
+# event manager without side effects
+async def send(command, idempotent=False):
+    dest = (str(command.ip), command.port)
+
+    # without a response, there is no way to know if a reused connection had
+    # been closed by the event manager and the command was lost
+    if not command.has_response():
+        reader, writer = await asyncio.open_connection(*dest)
+        conn = _Connection(reader, writer)
+
+        try:
+            await _write(conn, command)
+        finally:
+            conn.close()
+
+        return None
+
+    while True:
+        conn, reused = await _get_connection(dest,
+                                idempotent or dest in _keepalive)
+        written = False
+
+        try:
+            await _write(conn, command)
+            written = True
+            result = await ResultMessage.read(conn.reader)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            conn.close()
+
+            # retry only if the event manager cannot have processed the
+            # command, i.e., writing it failed, or if processing it again is
+            # harmless and the event manager did not start answering
+            partial = getattr(e, "partial", b'')
+            if not reused or partial or (written and not idempotent):
+                raise
+
+            # the event manager closed the connection after the last command
+            if dest not in _no_keepalive:
+                logging.debug("{}:{} does not keep connections alive ({})".format(
+                                *dest, e))
+                _no_keepalive.add(dest)
+
+            continue
+        except:
+            conn.close()
+            raise
+
+        if reused:
+            _keepalive.add(dest)
+
+        _put_connection(dest, conn)
+        return result
+
+
+# Send several commands with a response to the same event manager, pipelined
+# on one connection: all the commands are written, then the responses are read
+# in the same order. `idempotent` is a list with, for each command, the flag of
+# send(). Each command is answered within `timeout` seconds (if not None) from
+# when it is sent, or fails with asyncio.TimeoutError. Returns a list with, for
+# each command, its ResultMessage or the exception raised while sending it.
+#
+# The protocol has no multi-command frame, so pipelining relies on the event
+# manager processing the commands of a connection one after the other. Hence,
+# commands are pipelined only to event managers known to keep connections
+# alive (i.e., a reused connection was answered): until then, or if the event
+# manager closes connections after each message, they are sent one at a time.
+async def send_many(commands, idempotent, timeout=None):
+    dest = (str(commands[0].ip), commands[0].port)
+    results = []
+
+    while len(results) < len(commands) and \
+            (dest not in _keepalive or len(commands) - len(results) == 1):
+        try:
+            i = len(results)
+            results.append(await asyncio.wait_for(send(commands[i], idempotent[i]),
+                                                  timeout))
+        except Exception as e:
+            results.append(e)
+
+    pending = list(range(len(results), len(commands)))
+    if not pending:
+        return results
+
+    answers, error, reused = await _pipeline(dest, [commands[i] for i in pending],
+                                             timeout, True)
+    results.extend(answers)
+    pending = pending[len(answers):]
+
+    if error is None:
+        return results
+
+    results.extend([error] * len(pending))
+
+    # as in send(), a reused connection might have been closed while idle:
+    # the commands that can be processed twice are sent again on a new one,
+    # the others might have been processed or not, so they fail
+    if reused and isinstance(error, (ConnectionError, asyncio.IncompleteReadError)):
+        again = [i for i in pending if idempotent[i]]
+
+        if again:
+            answers, error, _ = await _pipeline(dest, [commands[i] for i in again],
+                                                timeout, False)
+            for i, result in zip(again, answers + [error] * len(again)):
+                results[i] = result
+
+    return results
+
+
+# Pipeline `commands` on one connection (reused if `reuse` is True). Returns
+# the responses read, the exception that stopped the pipeline (if any), and
+# whether the connection was reused
+async def _pipeline(dest, commands, timeout, reuse):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    conn, reused = await _get_connection(dest, reuse)
+    answers = []
+
+    try:
+        # all the commands are sent at the same time, so they share a deadline
+        for command in commands:
+            conn.writer.write(command.pack())
+        await asyncio.wait_for(conn.writer.drain(), _remaining(loop, deadline))
+
+        for command in commands:
+            answers.append(await asyncio.wait_for(ResultMessage.read(conn.reader),
+                                                  _remaining(loop, deadline)))
+    except Exception as e:
+        conn.close()
+        return answers, e, reused
+    except:
+        # e.g., cancelled
+        conn.close()
+        raise
+
+    _put_connection(dest, conn)
+    return answers, None, reused
+
+
+def _remaining(loop, deadline):
+    return max(0, deadline - loop.time()) if deadline is not None else None
+
+
+def close_all():
+    for idle in _idle.values():
+        for conn in idle:
+            conn.close()
+
+    _idle.clear()
@@ -1,13 +1,13 @@
 import asyncio
 import logging
 import binascii
-import aiofile
 import ipaddress
 from enum import IntEnum
 
 from reactivenet import *
 
 from .base import Node
+from .stream import StreamCommand, file_size
 from .. import tools
 from ..crypto import Encryption
 from ..dumpers import *
@@ -26,8 +26,9 @@ class SetKeyResultCode(IntEnum):
 
 class SancusNode(Node):
     def __init__(self, name, vendor_id, vendor_key,
-                 ip_address, reactive_port, deploy_port):
-        super().__init__(name, ip_address, reactive_port, deploy_port, need_lock=True)
+                 ip_address, reactive_port, deploy_port, max_inflight=1):
+        super().__init__(name, ip_address, reactive_port, deploy_port,
+                         max_inflight)
 
         self.vendor_id = vendor_id
         self.vendor_key = vendor_key
@@ -41,9 +42,11 @@ class SancusNode(Node):
         ip_address = ipaddress.ip_address(node_dict['ip_address'])
         reactive_port = node_dict['reactive_port']
         deploy_port = node_dict.get('deploy_port') or reactive_port
+        # by default, one command at a time
+        max_inflight = node_dict.get('max_inflight', 1)
 
         return SancusNode(name, vendor_id, vendor_key,
-                          ip_address, reactive_port, deploy_port)
+                          ip_address, reactive_port, deploy_port, max_inflight)
 
 
     def dump(self):
@@ -54,7 +57,8 @@ class SancusNode(Node):
             "vendor_id": self.vendor_id,
             "vendor_key": dump(self.vendor_key),
             "reactive_port": self.reactive_port,
-            "deploy_port": self.deploy_port
+            "deploy_port": self.deploy_port,
+            "max_inflight": self.max_inflight
         }
 
 
@@ -64,20 +68,30 @@ class SancusNode(Node):
         if module.deployed:
             return
 
-        async with aiofile.AIOFile(await module.binary, "rb") as f:
-            file_data = await f.read()
+        binary = await module.binary
 
         # The packet format is [NAME \0 VID ELF_FILE]
-        payload =   module.name.encode('ascii') + b'\0'   + \
-                    tools.pack_int16(self.vendor_id)      + \
-                    file_data
-
-        command = CommandMessage(ReactiveCommand.Load,
-                                Message(payload),
+        header =    module.name.encode('ascii') + b'\0'   + \
+                    tools.pack_int16(self.vendor_id)
+
+        # the ELF file is streamed, see stream.py
+        size = len(header) + file_size(binary)
+        if size > 0xffff:
+            raise Error('Binary of {} is too large ({} bytes)'.format(
+                            module.name, size))
+
+        parts = [
+            tools.pack_int8(ReactiveCommand.Load),
+            tools.pack_int16(size),
+            header,
+            binary
+        ]
+
+        command = StreamCommand(ReactiveCommand.Load, parts,
                                 self.ip_address,
                                 self.deploy_port)
 
-        res = await self._send_reactive_command(
+        res = await self._send_deploy_command(
                 command,
                 log='Deploying {} on {}'.format(module.name, self.name)
                 )
@@ -121,7 +135,8 @@ class SancusNode(Node):
 
         res = await self._send_reactive_command(
                 command,
-                log='Attesting {}'.format(module.name)
+                log='Attesting {}'.format(module.name),
+                idempotent=True
                 )
 
         # The result format is [tag] where the tag is the challenge's MAC
@@ -192,4 +207,5 @@ class SancusNode(Node):
 
         await self._send_reactive_command(
                 command,
-                log='Connecting id {} to {}'.format(conn_id, to_module.name))
+                log='Connecting id {} to {}'.format(conn_id, to_module.name),
+                idempotent=True)
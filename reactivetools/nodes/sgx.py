@@ -1,5 +1,4 @@
 import asyncio
-import aiofile
 import logging
 from abc import ABC, abstractmethod
 import binascii
@@ -8,6 +7,7 @@ import ipaddress
 from reactivenet import *
 
 from .base import Node
+from .stream import StreamCommand, file_size
 from ..connection import ConnectionIO
 from .. import glob
 from .. import tools
@@ -19,8 +19,10 @@ class Error(Exception):
     pass
 
 class SGXBase(Node):
-    def __init__(self, name, ip_address, reactive_port, deploy_port, module_id):
-        super().__init__(name, ip_address, reactive_port, deploy_port)
+    def __init__(self, name, ip_address, reactive_port, deploy_port, module_id,
+                 max_inflight=None):
+        super().__init__(name, ip_address, reactive_port, deploy_port,
+                         max_inflight)
 
         self._moduleid = module_id if module_id else 1
 
@@ -73,8 +75,10 @@ class SGXBase(Node):
 class SGXNode(SGXBase):
     type = "sgx"
 
-    def __init__(self, name, ip_address, reactive_port, deploy_port, module_id, aesm_port):
-        super().__init__(name, ip_address, reactive_port, deploy_port, module_id)
+    def __init__(self, name, ip_address, reactive_port, deploy_port, module_id,
+                 aesm_port, max_inflight=None):
+        super().__init__(name, ip_address, reactive_port, deploy_port, module_id,
+                         max_inflight)
 
         self.aesm_port = aesm_port or 13741
 
@@ -86,9 +90,10 @@ class SGXNode(SGXBase):
         deploy_port = node_dict.get('deploy_port') or reactive_port
         module_id = node_dict.get('module_id')
         aesm_port = node_dict.get('aesm_port')
+        max_inflight = node_dict.get('max_inflight')
 
         return SGXNode(name, ip_address, reactive_port, deploy_port,
-                    module_id, aesm_port)
+                    module_id, aesm_port, max_inflight)
 
 
     def dump(self):
@@ -99,7 +104,8 @@ class SGXNode(SGXBase):
             "reactive_port": self.reactive_port,
             "deploy_port": self.deploy_port,
             "module_id": self._moduleid,
-            "aesm_port": self.aesm_port
+            "aesm_port": self.aesm_port,
+            "max_inflight": self.max_inflight
         }
 
 
@@ -107,23 +113,23 @@ class SGXNode(SGXBase):
         if module.deployed:
             return
 
-        async with aiofile.AIOFile(await module.sgxs, "rb") as f:
-            sgxs = await f.read()
+        sgxs = await module.sgxs
+        sig = await module.sig
 
-        async with aiofile.AIOFile(await module.sig, "rb") as f:
-            sig = await f.read()
+        # the files are streamed, see stream.py
+        parts = [
+            tools.pack_int8(ReactiveCommand.Load),
+            tools.pack_int32(file_size(sgxs)),
+            sgxs,
+            tools.pack_int32(file_size(sig)),
+            sig
+        ]
 
-
-        payload =   tools.pack_int32(len(sgxs))                     + \
-                    sgxs                                            + \
-                    tools.pack_int32(len(sig))                      + \
-                    sig
-
-        command = CommandMessageLoad(payload,
+        command = StreamCommand(ReactiveCommand.Load, parts,
                                 self.ip_address,
                                 self.deploy_port)
 
-        await self._send_reactive_command(
+        await self._send_deploy_command(
             command,
             log='Deploying {} on {}'.format(module.name, self.name)
             )
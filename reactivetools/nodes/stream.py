@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+import os
+
+from reactivenet import ResultMessage
+
+# size of the chunks read from files when sendfile() is not available
+CHUNK_SIZE = 64 * 1024
+
+
+def file_size(file):
+    return os.path.getsize(file)
+
+
+class StreamCommand():
+    """
+    Command whose packet is streamed to the event manager, instead of being
+    built in memory (e.g., to load modules of several MBs)
+
+    `parts` is the list of the parts of the packet, in order, including the
+    command code and any length field: each part is either `bytes`, sent as
+    it is, or the name of a file, whose contents are sent with sendfile()
+    where supported, or in chunks of CHUNK_SIZE bytes otherwise.
+    The memory used does not depend on the size of the files.
+
+    It can be used in place of a reactivenet CommandMessage.
+    """
+
+    def __init__(self, code, parts, ip, port):
+        self.code = code
+        self.parts = parts
+        self.ip = ip
+        self.port = port
+
+
+    @property
+    def size(self):
+        return sum(len(part) if isinstance(part, (bytes, bytearray))
+                        else file_size(part) for part in self.parts)
+
+
+    def has_response(self):
+        return self.code.has_response()
+
+
+    async def send(self):
+        reader, writer = await asyncio.open_connection(str(self.ip), self.port)
+
+        with contextlib.closing(writer):
+            await self.write(writer)
+
+
+    async def send_wait(self):
+        reader, writer = await asyncio.open_connection(str(self.ip), self.port)
+
+        with contextlib.closing(writer):
+            await self.write(writer)
+            return await ResultMessage.read(reader)
+
+
+    async def write(self, writer):
+        for part in self.parts:
+            if isinstance(part, (bytes, bytearray)):
+                writer.write(part)
+            else:
+                await writer.drain()
+                await _write_file(writer, part)
+
+        await writer.drain()
+
+
+async def _write_file(writer, file):
+    loop = asyncio.get_event_loop()
+
+    with open(file, 'rb') as f:
+        # loop.sendfile is available from Python 3.7, and falls back to
+        # reading the file in chunks if the transport does not support it
+        if hasattr(loop, 'sendfile'):
+            await loop.sendfile(writer.transport, f)
+            return
+
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+            if not chunk:
+                break
+
+            writer.write(chunk)
+            await writer.drain()
@@ -0,0 +1,98 @@
+import importlib
+import logging
+
+
+class Error(Exception):
+    pass
+
+
+class Registry:
+    """
+    Registry of the architectures (node or module classes) supported
+
+    The module of each architecture is imported only the first time the
+    architecture is used, so that the dependencies of the other architectures
+    (e.g., the Sancus toolchain libraries) are not loaded at all.
+
+    Built-in architectures are declared as:
+        type -> (module, class name, rules file)
+    where module is relative to `package` and the rules file is relative to the
+    `rules/<nodes|modules>` folder.
+
+    Third-party architectures can be added by declaring an entry point in the
+    `group` group of their package, e.g. in their setup.py:
+        entry_points={
+            'reactivetools.modules': ['trustzone = mypkg.trustzone:TrustZoneModule']
+        }
+    The name of the entry point is the type used in the deployment descriptor.
+    The class can declare a `rules_file` attribute, containing the absolute
+    path of its rules file.
+    """
+
+    def __init__(self, package, group, builtins):
+        self.package = package
+        self.group = group
+        self.builtins = builtins
+
+        self.__classes = {}
+        self.__entry_points = None
+
+
+    def __contains__(self, type):
+        return type in self.builtins or type in self.__get_entry_points()
+
+
+    def get(self, type):
+        if type not in self.__classes:
+            self.__classes[type] = self.__import(type)
+
+        return self.__classes[type]
+
+
+    def get_rules(self, type):
+        if type in self.builtins:
+            _, _, rules = self.builtins[type]
+            return rules
+
+        return getattr(self.get(type), "rules_file", None)
+
+
+    def loaded(self):
+        return list(self.__classes.values())
+
+
+    def __import(self, type):
+        if type in self.builtins:
+            module, cls, _ = self.builtins[type]
+            logging.debug("Importing {} from {}{}".format(cls, self.package, module))
+            return getattr(importlib.import_module(module, self.package), cls)
+
+        entry_points = self.__get_entry_points()
+        if type not in entry_points:
+            raise Error("No architecture registered for type {}".format(type))
+
+        logging.debug("Importing {} from entry point {}".format(type, self.group))
+        return entry_points[type].load()
+
+
+    def __get_entry_points(self):
+        if self.__entry_points is None:
+            self.__entry_points = {ep.name: ep for ep in _iter_entry_points(self.group)}
+
+        return self.__entry_points
+
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+
+    eps = entry_points()
+
+    if hasattr(eps, "select"):
+        return list(eps.select(group=group))
+
+    return list(eps.get(group, []))
@@ -1,6 +1,7 @@
 import yaml
 import os
 import logging
+import functools
 
 from ..descriptor import DescriptorType
 
@@ -33,6 +34,7 @@ def authorized_keys(dict, keys):
 # file: relative path of the file from the "rules" directory
 # e.g., i want to load the rules of sancus.yaml under nodes folder:
 #       file == "nodes/sancus.yaml"
+@functools.lru_cache(maxsize=None)
 def load_rules(file):
     try:
         path = os.path.join(os.path.dirname(__file__), file)
@@ -42,3 +44,42 @@ def load_rules(file):
         logging.warning("Something went wrong during load of {}".format(file))
         logging.debug(e)
         return {}
+
+
+# Each rule file is parsed and compiled only once per process.
+# A rule that cannot be compiled is kept with a None code object,
+# so that it is reported as broken like a rule evaluating to False
+@functools.lru_cache(maxsize=None)
+def compile_rules(file):
+    rules = load_rules(file)
+    compiled = []
+
+    for r in rules:
+        try:
+            code = compile(str(rules[r]), "{}:{}".format(file, r), "eval")
+        except SyntaxError as e:
+            logging.warning("Bad rule in {}: {}".format(file, r))
+            logging.debug(e)
+            code = None
+
+        compiled.append((r, code))
+
+    return compiled
+
+
+# Returns the list of the rules in `file` that are not satisfied by `dict`
+def evaluate_rules(file, dict):
+    broken = []
+    env = globals().copy()
+    env["dict"] = dict
+
+    for r, code in compile_rules(file):
+        try:
+            result = code is not None and eval(code, env)
+        except:
+            result = False
+
+        if not result:
+            broken.append(r)
+
+    return broken
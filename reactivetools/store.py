@@ -0,0 +1,168 @@
+import sqlite3
+import json
+import contextlib
+
+from .descriptor import hexlify
+
+# SQLite-backed deployment descriptor.
+# Each section of the descriptor is stored in a table, with one row per
+# object. Rows are indexed by name and ID, and contain the object as JSON.
+# Scalar values (e.g., connections_current_id) are stored in the meta table.
+
+MAGIC = b"SQLite format 3\x00"
+
+# section in the descriptor -> table
+SECTIONS = {
+    "nodes"             : "nodes",
+    "modules"           : "modules",
+    "connections"       : "connections",
+    "periodic-events"   : "periodic_events"
+}
+
+META = ["connections_current_id", "events_current_id", "failures"]
+
+# seconds to wait for other processes holding a lock on the database
+TIMEOUT = 30
+
+
+class Error(Exception):
+    pass
+
+
+def _connect(file):
+    db = sqlite3.connect(file, timeout=TIMEOUT, isolation_level=None)
+
+    db.execute("CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT)")
+
+    for table in SECTIONS.values():
+        db.execute("CREATE TABLE IF NOT EXISTS {} (pos INTEGER PRIMARY KEY, "
+                    "name TEXT UNIQUE, id INTEGER, data TEXT NOT NULL)".format(table))
+        db.execute("CREATE INDEX IF NOT EXISTS {0}_id ON {0} (id)".format(table))
+
+    return db
+
+
+@contextlib.contextmanager
+def _transaction(file):
+    db = _connect(file)
+
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        yield db
+        db.execute("COMMIT")
+    except:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        raise
+    finally:
+        db.close()
+
+
+def _encode(obj):
+    return json.dumps(obj, default=hexlify)
+
+
+def load(file):
+    contents = load_meta(file)
+
+    with contextlib.closing(_connect(file)) as db:
+        for section, table in SECTIONS.items():
+            rows = db.execute("SELECT data FROM {} ORDER BY pos".format(table))
+            contents[section] = [json.loads(data) for data, in rows]
+
+        return contents
+
+
+def dump(file, data):
+    with _transaction(file) as db:
+        db.execute("DELETE FROM meta")
+        for key in META:
+            if key in data:
+                db.execute("INSERT INTO meta VALUES (?, ?)",
+                            (key, _encode(data[key])))
+
+        for section, table in SECTIONS.items():
+            db.execute("DELETE FROM {}".format(table))
+            db.executemany(
+                "INSERT INTO {} (name, id, data) VALUES (?, ?, ?)".format(table),
+                ((o.get("name"), o.get("id"), _encode(o))
+                    for o in data.get(section) or [])
+            )
+
+
+def load_meta(file):
+    with contextlib.closing(_connect(file)) as db:
+        return {key: json.loads(value)
+                    for key, value in db.execute("SELECT key, value FROM meta")}
+
+
+# Get a single object, by name or by ID (None if not found)
+def get_object(file, section, key, value):
+    assert key in ["name", "id"]
+    table = SECTIONS[section]
+
+    with contextlib.closing(_connect(file)) as db:
+        row = db.execute("SELECT data FROM {} WHERE {} = ?".format(table, key),
+                            (value,)).fetchone()
+
+    return json.loads(row[0]) if row is not None else None
+
+
+# Apply a list of journal entries (see journal.py), each in its own transaction.
+# If `reserved` is given, nonces are reserved with reserve_nonce: it maps the
+# connections that reserved nonces in advance to the end of their reservation.
+# The nonce of those connections is written only if no other nonces have been
+# reserved since, giving back the unused ones, and never for the others
+def update(file, entries, reserved=None):
+    for entry in entries:
+        with _transaction(file) as db:
+            obj = _get_row(db, entry["section"], entry["name"])
+            fields = dict(entry["fields"])
+
+            if reserved is not None and entry["section"] == "connections" and \
+                    (entry["name"] not in reserved or
+                     obj.get("nonce") != reserved[entry["name"]]):
+                fields.pop("nonce", None)
+
+            obj.update(fields)
+            _put_row(db, entry["section"], entry["name"], obj)
+
+
+# Reserve `count` nonces of a connection, returning the first one. The nonce
+# is read and incremented in the same transaction, so that concurrent
+# processes never get the same nonces
+def reserve_nonce(file, name, count):
+    with _transaction(file) as db:
+        obj = _get_row(db, "connections", name)
+        nonce = obj.get("nonce") or 0
+        obj["nonce"] = nonce + count
+        _put_row(db, "connections", name, obj)
+
+    return nonce
+
+
+# Give back the nonces reserved by reserve_nonce, unless other nonces of the
+# connection have been reserved since
+def release_nonce(file, name, nonce, count):
+    with _transaction(file) as db:
+        obj = _get_row(db, "connections", name)
+        if obj.get("nonce") == nonce + count:
+            obj["nonce"] = nonce
+            _put_row(db, "connections", name, obj)
+
+
+def _get_row(db, section, name):
+    table = SECTIONS[section]
+    row = db.execute("SELECT data FROM {} WHERE name = ?".format(table),
+                        (name,)).fetchone()
+
+    if row is None:
+        raise Error("No object {} in {}".format(name, table))
+
+    return json.loads(row[0])
+
+
+def _put_row(db, section, name, obj):
+    db.execute("UPDATE {} SET data = ? WHERE name = ?".format(SECTIONS[section]),
+                (_encode(obj), name))
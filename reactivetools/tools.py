@@ -2,8 +2,10 @@ import logging
 import tempfile
 import os
 import asyncio
+import collections
 import base64
 import struct
+import time
 from enum import Enum
 
 from . import glob
@@ -53,14 +55,179 @@ def init_future(*results):
     return fut
 
 
-async def run_async(*args, output_file=os.devnull, env=None):
-    logging.debug(' '.join(args))
+class Jobserver:
+    """
+    Limits the number of build jobs running at the same time
 
-    process = await asyncio.create_subprocess_exec(*args,
+    Each process started by run_async and run_async_shell holds a job slot.
+    Slots are tokens in a GNU make jobserver pipe, which is passed to the
+    processes through MAKEFLAGS and CARGO_MAKEFLAGS: this way, a nested
+    `make -j` or `cargo build` takes its additional jobs from the same budget.
+
+    If the pipe cannot be shared (non-Linux systems), slots are only managed
+    through a semaphore and nested parallelism is not limited.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+        self.__lock = asyncio.Lock()
+        self.__semaphore = None
+        self.__reader = None
+        self.__pipe = None
+
+        try:
+            self.__setup_pipe()
+        except OSError as e:
+            logging.debug("Jobserver pipe not available: {}".format(e))
+            self.__semaphore = asyncio.Semaphore(jobs)
+
+
+    def __setup_pipe(self):
+        r, w = os.pipe()
+
+        try:
+            # our own end, non-blocking. It must be a different open file
+            # description than the read end inherited by the children, which
+            # expect a blocking pipe
+            self.__reader = os.open("/proc/self/fd/{}".format(r),
+                                    os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            os.close(r)
+            os.close(w)
+            raise
+
+        os.write(w, b'+' * self.jobs)
+        self.__pipe = (r, w)
+
+
+    async def acquire(self):
+        if self.__semaphore is not None:
+            await self.__semaphore.acquire()
+            return None
+
+        # only one coroutine at a time can wait on the pipe
+        async with self.__lock:
+            loop = asyncio.get_event_loop()
+
+            while True:
+                try:
+                    return os.read(self.__reader, 1)
+                except BlockingIOError:
+                    pass
+
+                readable = loop.create_future()
+                loop.add_reader(self.__reader, readable.set_result, None)
+
+                try:
+                    await readable
+                finally:
+                    loop.remove_reader(self.__reader)
+
+
+    def release(self, token):
+        if self.__semaphore is not None:
+            self.__semaphore.release()
+        else:
+            os.write(self.__pipe[1], token)
+
+
+    def get_env(self, env):
+        if self.__pipe is None:
+            return env, ()
+
+        flags = " -j{0} --jobserver-fds={1},{2} --jobserver-auth={1},{2}".format(
+                    self.jobs, *self.__pipe)
+
+        env = dict(os.environ if env is None else env)
+        env["MAKEFLAGS"] = flags
+        env["CARGO_MAKEFLAGS"] = flags
+
+        return env, self.__pipe
+
+
+    def close(self):
+        if self.__pipe is not None:
+            os.close(self.__reader)
+            os.close(self.__pipe[0])
+            os.close(self.__pipe[1])
+            self.__reader = None
+            self.__pipe = None
+
+
+_jobserver = None
+
+# time spent by each label (e.g., module) waiting for a job slot
+_job_waits = {}
+
+
+# The jobserver is created on first use, after the CLI has set the number of
+# jobs, and lives until shutdown_jobserver
+def get_jobserver():
+    global _jobserver
+
+    if _jobserver is None:
+        _jobserver = Jobserver(glob.get_jobs())
+
+    return _jobserver
+
+
+def shutdown_jobserver():
+    global _jobserver
+
+    if _jobserver is not None:
+        _jobserver.close()
+        _jobserver = None
+
+
+class JobSlot:
+    """
+    Async context manager holding a job slot while running a process
+
+    The time spent waiting for the slot is accounted to `label`, if any.
+    """
+
+    def __init__(self, label=None):
+        self.label = label
+        self.jobserver = None
+        self.__token = None
+
+
+    async def __aenter__(self):
+        self.jobserver = get_jobserver()
+
+        start = time.monotonic()
+        self.__token = await self.jobserver.acquire()
+        wait = time.monotonic() - start
+
+        if self.label is not None:
+            _job_waits[self.label] = _job_waits.get(self.label, 0) + wait
+
+        return self.jobserver
+
+
+    async def __aexit__(self, *exc):
+        self.jobserver.release(self.__token)
+
+
+def log_job_waits():
+    for label, wait in sorted(_job_waits.items()):
+        logging.info("{} waited {:.2f}s for a job slot".format(label, wait))
+
+    _job_waits.clear()
+
+
+async def run_async(*args, output_file=os.devnull, env=None, label=None):
+    async with JobSlot(label) as jobserver:
+        logging.debug(' '.join(args))
+
+        env, fds = jobserver.get_env(env)
+        process = await asyncio.create_subprocess_exec(*args,
                                             stdout=open(output_file, 'wb'),
                                             stderr=get_stderr(),
-                                            env=env)
-    result = await process.wait()
+                                            env=env,
+                                            pass_fds=fds)
+        result = await process.wait()
 
     if result != 0:
         raise ProcessRunError(args, result)
@@ -92,21 +259,117 @@ async def run_async_output(*args, env=None):
     return out, err
 
 
-async def run_async_shell(*args, env=None):
+async def run_async_shell(*args, env=None, label=None):
     cmd = ' '.join(args)
-    logging.debug(cmd)
-    process = await asyncio.create_subprocess_shell(cmd,
+
+    async with JobSlot(label) as jobserver:
+        logging.debug(cmd)
+
+        env, fds = jobserver.get_env(env)
+        process = await asyncio.create_subprocess_shell(cmd,
                                             stdout=open(os.devnull, 'wb'),
                                             stderr=get_stderr(),
-                                            env=env)
-    result = await process.wait()
+                                            env=env,
+                                            pass_fds=fds)
+        result = await process.wait()
 
     if result != 0:
         raise ProcessRunError(args, result)
 
 
+_process_pool = None
+
+# Run a CPU-bound function (e.g., a code generator) in a pool of worker
+# processes, without blocking the event loop. `func` and its arguments must
+# be picklable
+async def run_in_process(func, *args):
+    global _process_pool
+
+    if _process_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _process_pool = ProcessPoolExecutor(glob.get_codegen_workers())
+
+    return await asyncio.get_event_loop().run_in_executor(_process_pool,
+                                                            func, *args)
+
+
+def shutdown_process_pool():
+    global _process_pool
+
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+
+class ByteBudget:
+    """
+    Semaphore counting bytes instead of tasks, e.g., to limit the size of the
+    modules being deployed at the same time
+
+    Waiters are served in FIFO order, so that large requests do not starve.
+    A request larger than the whole budget waits until it can take all of it.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.available = capacity
+        self.__waiters = collections.deque()
+
+
+    async def acquire(self, size):
+        size = min(size, self.capacity)
+
+        if not self.__waiters and size <= self.available:
+            self.available -= size
+            return size
+
+        fut = asyncio.get_event_loop().create_future()
+        self.__waiters.append((size, fut))
+
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(size)
+            raise
+
+        return size
+
+
+    def release(self, size):
+        self.available += size
+
+        while self.__waiters:
+            size, fut = self.__waiters[0]
+
+            if fut.done():
+                # cancelled while waiting
+                self.__waiters.popleft()
+                continue
+
+            if size > self.available:
+                break
+
+            self.__waiters.popleft()
+            self.available -= size
+            fut.set_result(None)
+
+
+_path_locks = {}
+
+# Lock serializing the processes working on `path` (e.g., a build directory)
+def get_path_lock(path):
+    path = os.path.abspath(path)
+
+    if path not in _path_locks:
+        _path_locks[path] = asyncio.Lock()
+
+    return _path_locks[path]
+
+
 def create_tmp(suffix='', dir=''):
     dir = os.path.join(glob.BUILD_DIR, dir)
+    os.makedirs(dir, exist_ok=True)
     fd, path = tempfile.mkstemp(suffix=suffix, dir=dir)
     os.close(fd)
     return path
@@ -15,11 +15,11 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         'pyelftools==0.27',
-        'aiofile==3.3.3',
         'pycryptodome==3.10.1',
         'reactive-net==0.2',
         'rust-sgx-gen==0.1.3',
-        'PyYAML==5.4.1'
+        'PyYAML==5.4.1',
+        'msgpack==1.0.2'
     ],
     classifiers=[
         "Programming Language :: Python :: 3",